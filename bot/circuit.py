@@ -0,0 +1,114 @@
+import threading
+import time
+from collections import deque
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency whose circuit is open."""
+
+    def __init__(self, name, retry_in):
+        super().__init__(f"{name} is unavailable (circuit open, retry in {retry_in:.0f}s)")
+        self.name = name
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """
+    Failure-rate circuit breaker for one dependency.
+
+    Outcomes of the last `window` calls are kept; once at least `min_calls`
+    are recorded and the failure share reaches `failure_rate`, the circuit
+    opens and calls fail fast for `open_seconds`. After that a limited number
+    of half-open probe calls are let through: a success closes the circuit, a
+    failure opens it again.
+    """
+
+    def __init__(self, name, window=20, min_calls=4, failure_rate=0.5, open_seconds=30, half_open_probes=1):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self._outcomes = deque(maxlen=window)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            self._maybe_half_open()
+            return self._state
+
+    @property
+    def is_open(self):
+        return self.state == OPEN
+
+    def _maybe_half_open(self):
+        now = time.monotonic()
+        if self._state == OPEN and now - self._opened_at >= self.open_seconds:
+            self._state = HALF_OPEN
+            self._probes = 0
+            self._opened_at = now
+        elif self._state == HALF_OPEN and now - self._opened_at >= self.open_seconds:
+            self._probes = 0  # a probe never reported back; let another one through
+            self._opened_at = now
+
+    def _open(self):
+        if self._state != OPEN:
+            print(f"Circuit '{self.name}' opened")
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+
+    def allow(self):
+        """True if a call may go through now (claims a probe slot when half-open)."""
+        with self._lock:
+            self._maybe_half_open()
+            if self._state == CLOSED:
+                return True
+            if self._state == HALF_OPEN and self._probes < self.half_open_probes:
+                self._probes += 1
+                return True
+            return False
+
+    def retry_in(self):
+        with self._lock:
+            return max(0.0, self.open_seconds - (time.monotonic() - self._opened_at))
+
+    def record_success(self):
+        with self._lock:
+            if self._state == HALF_OPEN:
+                print(f"Circuit '{self.name}' closed")
+                self._state = CLOSED
+                self._outcomes.clear()
+            self._outcomes.append(True)
+
+    def record_failure(self):
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._open()
+                return
+            self._outcomes.append(False)
+            failures = self._outcomes.count(False)
+            if len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.failure_rate:
+                self._open()
+
+    def check(self):
+        """Raise CircuitOpenError unless a call may go through."""
+        if not self.allow():
+            raise CircuitOpenError(self.name, self.retry_in())
+
+    def call(self, fn, *args, **kwargs):
+        self.check()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success()
+        return result
@@ -0,0 +1,117 @@
+import asyncio
+
+from bot.session import new_session
+
+# Dialog states, stored as session["state"]
+AWAITING_PROBLEM = "awaiting_problem"
+AWAITING_CLARIFICATION = "awaiting_clarification"
+AWAITING_KB_CONFIRM = "awaiting_kb_confirm"
+AWAITING_TICKET_CONFIRM = "awaiting_ticket_confirm"
+AWAITING_DUPLICATE_CONFIRM = "awaiting_duplicate_confirm"
+AWAITING_TICKET_ACTION_CONFIRM = "awaiting_ticket_action_confirm"
+
+ANY = "*"  # wildcard state for transitions valid everywhere
+
+YES_WORDS = {"yes", "y"}
+NO_WORDS = {"no", "n"}
+
+
+def reply_event(text):
+    """"yes"/"no" for a bare confirmation reply, otherwise None."""
+    lowered = text.lower()
+    if lowered in YES_WORDS:
+        return "yes"
+    if lowered in NO_WORDS:
+        return "no"
+    return None
+
+
+class DialogContext:
+    """
+    Everything a transition handler needs for one incoming message. The
+    session is loaded once per message and written once by the caller after
+    dispatch; handlers only mutate `session`.
+    """
+
+    def __init__(self, user_id, username, msg, channel, session):
+        self.user_id = user_id
+        self.username = username
+        self.msg = msg
+        self.channel = channel
+        self.session = session
+        self.tasks = []
+
+    @property
+    def state(self):
+        return self.session.get("state") or AWAITING_PROBLEM
+
+    @property
+    def data(self):
+        """State-specific data, e.g. the ticket a duplicate prompt refers to."""
+        return self.session.get("ctx") or {}
+
+    def goto(self, state, **data):
+        self.session["state"] = state
+        # Kept compact: only present while the state actually carries data
+        if data:
+            self.session["ctx"] = data
+        else:
+            self.session.pop("ctx", None)
+
+    def reset(self):
+        """Start a fresh conversation, keeping the user's tickets."""
+        self.session = new_session(self.user_id, self.session.get("tickets", []))
+
+
+class DialogMachine:
+    """
+    Table-driven dialog: handlers are registered for (state, event) pairs and
+    looked up with a single dict access per message. Events are confirmation
+    replies ("yes"/"no"), universal commands and router actions.
+
+    on_enter hooks run as background tasks when a transition lands in a state,
+    so side effects like prefetching never delay the reply.
+    """
+
+    def __init__(self):
+        self._transitions = {}
+        self._on_enter = {}
+        self._background = set()
+
+    def on(self, states, events):
+        states = [states] if isinstance(states, str) else states
+        events = [events] if isinstance(events, str) else events
+
+        def register(handler):
+            for state in states:
+                for event in events:
+                    self._transitions[(state, event)] = handler
+            return handler
+        return register
+
+    def on_enter(self, state):
+        def register(hook):
+            self._on_enter.setdefault(state, []).append(hook)
+            return hook
+        return register
+
+    def handler_for(self, state, event):
+        return self._transitions.get((state, event)) or self._transitions.get((ANY, event))
+
+    def spawn(self, coro):
+        task = asyncio.ensure_future(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+        return task
+
+    async def dispatch(self, ctx, event):
+        """Run the handler for (ctx.state, event). Returns False if there is none."""
+        handler = self.handler_for(ctx.state, event)
+        if handler is None:
+            return False
+        before = ctx.state
+        await handler(ctx)
+        if ctx.state != before:
+            for hook in self._on_enter.get(ctx.state, ()):
+                self.spawn(hook(ctx))
+        return True
@@ -0,0 +1,214 @@
+import os
+import json
+import random
+import threading
+import re
+import time
+import zlib
+
+DUPLICATES_DB_PATH = os.path.join(os.path.dirname(__file__), "duplicate_index.json")
+
+NUM_PERM = 128
+BANDS = 32  # LSH bands of NUM_PERM // BANDS rows each
+USER_THRESHOLD = 0.55   # estimated Jaccard needed to match one of the user's own tickets
+GLOBAL_THRESHOLD = 0.8  # stricter bar for tickets raised by other users
+SIGNATURE_VERSION = 3   # bump when shingling changes; older index entries are dropped on load
+MAX_ENTRIES = 1000
+MAX_AGE = 30 * 24 * 3600  # only recent tickets are considered duplicates
+CLOSED_STATUSES = {"closed", "resolved"}  # tickets in these states are no longer offered as duplicates
+
+_PRIME = (1 << 61) - 1
+_rng = random.Random(1234)
+_PERMS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+_ROWS = NUM_PERM // BANDS
+
+_index = None
+# Tickets are indexed from worker threads while the loop looks up and forgets them
+_index_lock = threading.Lock()
+
+
+# Words every report shares; left in, they make different problems look alike
+STOP_WORDS = {
+    "a", "an", "the", "my", "our", "i", "it", "its", "is", "are", "was", "be", "been", "has", "have", "and",
+    "or", "of", "to", "in", "on", "at", "from", "for", "with", "after", "during", "every", "this", "that",
+    "there", "when", "then", "and", "but", "so", "any", "some", "keeps", "still", "just", "very", "please",
+    "washing", "machine", "washer", "wash", "won", "t", "doesn", "don", "isn", "can", "cannot", "will",
+    "problem", "issue", "help", "ticket", "tickets", "support", "case", "report", "request", "create", "raise",
+    "need", "want", "contact", "talk", "someone", "agent", "yes", "no", "hi", "hello", "thanks", "thank", "you", "me",
+}
+# Asking for a ticket says nothing about the fault ("open" stays a content word in "door won't open")
+REQUEST_RE = re.compile(r"\b(?:open|file|log|submit|make|get)\s+(?:(?:a|an|new|the|my|support)\s+)*(?:ticket|case|report|request)s?\b")
+SUFFIXES = ("ing", "ed", "es", "s")
+
+
+def _stem(word):
+    for suffix in SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)]
+    return word
+
+
+def _normalize(text):
+    words = re.sub(r"[^a-z0-9 ]+", " ", REQUEST_RE.sub(" ", (text or "").lower())).split()
+    return [_stem(w) for w in words if w not in STOP_WORDS]
+
+
+def _shingles(text):
+    """
+    Content words only: reworded reports of one fault keep the same words in
+    a different order, while "door open" and "door close" share just "door".
+    """
+    return set(_normalize(text))
+
+
+def _codes(text):
+    """Error codes, model numbers and the like: words containing a digit."""
+    return sorted({w for w in _normalize(text) if any(c.isdigit() for c in w)})
+
+
+def signature(text):
+    """MinHash signature of the text's word shingles."""
+    hashes = [zlib.crc32(s.encode("utf-8")) for s in _shingles(text)]
+    if not hashes:
+        return []
+    return [min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMS]
+
+
+def similarity(sig_a, sig_b):
+    """Estimated Jaccard similarity of two signatures."""
+    if not sig_a or not sig_b:
+        return 0.0
+    return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / NUM_PERM
+
+
+def _band_keys(sig):
+    return [f"{i}:{zlib.crc32(str(sig[i * _ROWS:(i + 1) * _ROWS]).encode())}" for i in range(BANDS)]
+
+
+class DuplicateIndex:
+    """
+    Near-duplicate index over recent ticket problem texts. Candidates are found
+    through LSH band buckets, then scored by signature agreement.
+    """
+
+    def __init__(self, entries=None):
+        self.entries = {}
+        self.buckets = {}
+        for entry in entries or []:
+            self._insert(entry)
+
+    def _insert(self, entry):
+        tid = int(entry["ticket_id"])
+        self.entries[tid] = entry
+        for key in _band_keys(entry["sig"]):
+            self.buckets.setdefault(key, set()).add(tid)
+
+    def remove(self, ticket_id):
+        entry = self.entries.pop(int(ticket_id), None)
+        if not entry:
+            return False
+        for key in _band_keys(entry["sig"]):
+            bucket = self.buckets.get(key)
+            if bucket:
+                bucket.discard(int(ticket_id))
+                if not bucket:
+                    del self.buckets[key]
+        return True
+
+    def add(self, ticket_id, user_id, text):
+        sig = signature(text)
+        if not sig:
+            return
+        self.remove(ticket_id)
+        self._insert({
+            "ticket_id": int(ticket_id), "user_id": str(user_id), "sig": sig, "codes": _codes(text),
+            "created_at": time.time(), "v": SIGNATURE_VERSION,
+        })
+        self.prune()
+
+    def prune(self, now=None):
+        now = now or time.time()
+        for tid, entry in list(self.entries.items()):
+            if now - entry["created_at"] > MAX_AGE:
+                self.remove(tid)
+        if len(self.entries) > MAX_ENTRIES:
+            oldest = sorted(self.entries.values(), key=lambda e: e["created_at"])
+            for entry in oldest[:len(self.entries) - MAX_ENTRIES]:
+                self.remove(entry["ticket_id"])
+
+    def find(self, user_id, text):
+        """
+        Return {"ticket_id", "user_id", "score", "own"} for the best match above
+        threshold, preferring the user's own tickets, or None.
+        """
+        sig = signature(text)
+        if not sig:
+            return None
+        candidates = set()
+        for key in _band_keys(sig):
+            candidates.update(self.buckets.get(key, ()))
+        codes = _codes(text)
+        best = None
+        now = time.time()
+        for tid in candidates:
+            entry = self.entries[tid]
+            if now - entry["created_at"] > MAX_AGE:
+                continue
+            # "error E21" and "error E18" are different faults however alike the rest reads
+            if codes and entry["codes"] and codes != entry["codes"]:
+                continue
+            own = entry["user_id"] == str(user_id)
+            score = similarity(sig, entry["sig"])
+            if score < (USER_THRESHOLD if own else GLOBAL_THRESHOLD):
+                continue
+            rank = (own, score)
+            if best is None or rank > (best["own"], best["score"]):
+                best = {"ticket_id": tid, "user_id": entry["user_id"], "score": score, "own": own}
+        return best
+
+    def to_list(self):
+        return list(self.entries.values())
+
+
+def _load_index():
+    global _index
+    if _index is None:
+        entries = []
+        if os.path.exists(DUPLICATES_DB_PATH):
+            with open(DUPLICATES_DB_PATH, "r", encoding="utf-8") as f:
+                entries = [e for e in json.load(f) if e.get("v") == SIGNATURE_VERSION]
+        _index = DuplicateIndex(entries)
+    return _index
+
+
+def _save_index(index):
+    tmp_path = DUPLICATES_DB_PATH + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index.to_list(), f)
+    os.replace(tmp_path, DUPLICATES_DB_PATH)
+
+
+def find_duplicate(user_id, text):
+    """The best match for text (see DuplicateIndex.find), or None; text without content words never matches."""
+    with _index_lock:
+        return _load_index().find(user_id, text)
+
+
+def index_ticket(user_id, ticket_id, text):
+    with _index_lock:
+        index = _load_index()
+        index.add(ticket_id, user_id, text)
+        _save_index(index)
+
+
+def ticket_status_changed(ticket_id, status):
+    """Keep the index in step with a status seen elsewhere (webhook, status sync)."""
+    if (status or "").lower() in CLOSED_STATUSES:
+        forget_ticket(ticket_id)
+
+
+def forget_ticket(ticket_id):
+    with _index_lock:
+        index = _load_index()
+        if index.remove(ticket_id):
+            _save_index(index)
@@ -0,0 +1,98 @@
+import os
+from contextlib import contextmanager
+
+from bot.outbound import RateBucket
+
+
+def _limit(name, default):
+    """A "count/seconds" limit from the environment, e.g. LIMIT_ROUTER=10/60."""
+    value = os.getenv(name, default)
+    count, per = value.split("/")
+    return int(count), float(per)
+
+
+# Per-user budgets by action class: router is every message that needs the
+# LLM to route it, troubleshoot a KB-grounded answer, ticket a ticket creation
+# and pick_ticket asking the LLM which ticket an ambiguous close/delete means.
+LIMITS = {
+    "router": _limit("LIMIT_ROUTER", "10/60"),
+    "troubleshoot": _limit("LIMIT_TROUBLESHOOT", "5/60"),
+    "ticket": _limit("LIMIT_TICKET", "3/300"),
+    "pick_ticket": _limit("LIMIT_PICK_TICKET", "5/60"),
+}
+# Expensive actions running at once, across all users; beyond it we shed
+# rather than queue, since everyone shares the one Ollama backend.
+MAX_INFLIGHT = int(os.getenv("LIMIT_MAX_INFLIGHT", "8"))
+MAX_BUCKETS = 10000  # idle (full) per-user buckets are dropped beyond this
+LOG_EVERY = 50       # refusals between stats log lines
+
+RATE_LIMITED_MESSAGES = {
+    "router": "⏳ You're sending messages faster than I can keep up with. Please wait about {wait}s and try again.",
+    "troubleshoot": "⏳ I've looked up quite a few fixes for you just now. Please wait about {wait}s before the next one.",
+    "ticket": "⏳ You've created several tickets in a short time. Please wait about {wait}s before creating another.",
+    "pick_ticket": "⏳ I can't work out which ticket you mean right now. Please give me its ID, or try again in about {wait}s.",
+}
+SHED_MESSAGE = "🚦 I'm handling a lot of requests right now. Please try again in a few seconds."
+
+
+class IngressLimiter:
+    """
+    Admission control for LLM-backed work: a token bucket per (user, action
+    class) and a global cap on in-flight expensive actions. Refusals are
+    answered with a canned message instead of a model call.
+    """
+
+    def __init__(self, limits=None, max_inflight=MAX_INFLIGHT):
+        self.limits = dict(LIMITS if limits is None else limits)
+        self.max_inflight = max_inflight
+        self.inflight = 0
+        self._buckets = {}
+        self.stats = {
+            "by_class": {c: {"admitted": 0, "rate_limited": 0, "shed": 0} for c in self.limits},
+            "peak_inflight": 0,
+        }
+        self._refusals = 0
+
+    def _bucket(self, user_id, action_class):
+        key = (str(user_id), action_class)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= MAX_BUCKETS:
+                self._buckets = {k: b for k, b in self._buckets.items() if not b.full}
+            bucket = self._buckets[key] = RateBucket(*self.limits[action_class])
+        return bucket
+
+    def admit(self, user_id, action_class):
+        """None if the action may run (release() must follow), otherwise the canned reply."""
+        counters = self.stats["by_class"][action_class]
+        if self.inflight >= self.max_inflight:
+            counters["shed"] += 1
+            return self._refuse(SHED_MESSAGE)
+        bucket = self._bucket(user_id, action_class)
+        if not bucket.try_acquire():
+            counters["rate_limited"] += 1
+            wait = max(1, round(bucket.retry_in()))
+            return self._refuse(RATE_LIMITED_MESSAGES[action_class].format(wait=wait))
+        counters["admitted"] += 1
+        self.inflight += 1
+        self.stats["peak_inflight"] = max(self.stats["peak_inflight"], self.inflight)
+        return None
+
+    def release(self):
+        self.inflight = max(0, self.inflight - 1)
+
+    @contextmanager
+    def slot(self, user_id, action_class):
+        """Yields None while an admitted action runs, or the refusal text."""
+        refusal = self.admit(user_id, action_class)
+        try:
+            yield refusal
+        finally:
+            if refusal is None:
+                self.release()
+
+    def _refuse(self, text):
+        self._refusals += 1
+        if self._refusals % LOG_EVERY == 0:
+            print(f"Ingress limits: {self.stats}, in flight: {self.inflight}")
+        return text
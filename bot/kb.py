@@ -1,32 +1,132 @@
 import json
 import os
-import ollama
+import re
+import time
+
+from bot import kb_snapshot
+from bot.llm import MODEL
+from bot.llm_tasks import LLMTask, register, run_task
+from bot.prompt_budget import fit_lines, rank_by_relevance, remaining
 
 KB_PATH = os.path.join(os.path.dirname(__file__), 'knowledge_base.json')
 
-with open(KB_PATH, encoding='utf-8') as f:
-    KB_DATA = json.load(f)
+RELOAD_CHECK = 10  # seconds between checks for a newly published compiled snapshot
+
+_kb_data = None
+_kb_version = None
+_kb_checked = 0.0
+
+def _load_kb():
+    """
+    Load the KB from the published compiled snapshot (memory-mapped, needs
+    numpy), otherwise parse the JSON source.
+    """
+    compiled = kb_snapshot.open_current(KB_PATH)
+    if compiled is not None:
+        return compiled
+    with open(KB_PATH, encoding='utf-8') as f:
+        return json.load(f)
+
+def get_kb():
+    """The knowledge base, loaded on first use and reloaded when a new compiled snapshot is published."""
+    global _kb_data, _kb_version, _kb_checked
+    now = time.monotonic()
+    if _kb_data is None or now - _kb_checked > RELOAD_CHECK:
+        _kb_checked = now
+        version = kb_snapshot.current_version()
+        if _kb_data is None or version != _kb_version:
+            _kb_data = _load_kb()
+            _kb_version = version
+    return _kb_data
+
+def _candidate_issues(text, kb_data):
+    """
+    Issues worth scoring against text, in KB order: a compiled snapshot narrows
+    them down by its postings, which hold every issue sharing a word with text.
+    """
+    if isinstance(kb_data, kb_snapshot.CompiledKB):
+        return [kb_data.issue(i) for i in sorted(kb_data.candidates(text))]
+    return list(kb_data["issues"].values())
 
 OUT_OF_SCOPE_KEYWORDS = [
     "joke", "funny", "laugh", "weather", "news", "song", "music", "python", "java", "write code", "script", "draw", "art"
 ]
 
+# Whole words only: "art" must not match "start"
+_OUT_OF_SCOPE_RE = re.compile(r"\b(?:" + "|".join(re.escape(kw) for kw in OUT_OF_SCOPE_KEYWORDS) + r")s?\b")
+
 def is_out_of_scope(text):
-    lowered = text.lower()
-    return any(kw in lowered for kw in OUT_OF_SCOPE_KEYWORDS)
+    return _OUT_OF_SCOPE_RE.search(text.lower()) is not None
+
+# Title words too generic to signal a match on their own
+KB_STOP_WORDS = {"machine", "washing", "washer", "from", "during", "with", "not", "the", "or", "and", "on", "properly"}
 
-def llm_troubleshoot(user_message, kb_data=KB_DATA, clarification_mode=False):
+def kb_search(text, kb_data=None, limit=1):
+    """
+    KB issues matching the text by keyword, best first. Whole keyword phrases
+    found in the text count most; single shared words break ties.
+    """
+    kb_data = kb_data or get_kb()
+    lowered = text.lower()
+    text_words = set(lowered.split()) - KB_STOP_WORDS
+    scored = []
+    for issue in _candidate_issues(text, kb_data):
+        score = sum(2 for kw in issue["keywords"] if kw.lower() in lowered)
+        score += len(text_words & set(issue["title"].lower().split()))
+        if score:
+            scored.append((score, issue))
+    scored.sort(key=lambda pair: pair[0], reverse=True)
+    return [issue for _, issue in scored[:limit]]
+
+def kb_answer(text, kb_data=None):
+    """Troubleshooting steps straight from the best KB match, or None. Used without the LLM."""
+    matches = kb_search(text, kb_data)
+    if not matches:
+        return None
+    issue = matches[0]
+    steps = "\n".join(
+        f"{s['step']}. {s['action']}: {s['description']}" for s in issue.get("troubleshooting_steps", [])
+    )
+    return f"**{issue['title']}**\n{steps}"
+
+def _kb_snippets(user_message, issues):
+    # Most relevant KB entries first
+    issues = rank_by_relevance(
+        user_message, issues, key=lambda issue: f"{issue['title']} {' '.join(issue['keywords'])}"
+    )
+    return [
+        f"{issue['title']}: {issue['description']} (Keywords: {', '.join(issue['keywords'])})"
+        for issue in issues
+    ]
+
+def _build_troubleshoot_prompt(user_message, kb_data, clarification_mode):
+    # As many KB entries as fit in the troubleshoot budget
+    base = _troubleshoot_prompt(user_message, "", clarification_mode)
+    budget = remaining("troubleshoot", base, model=MODEL)
+    kb_snippets, dropped = fit_lines(_kb_snippets(user_message, _candidate_issues(user_message, kb_data)), budget, MODEL)
+    if not dropped and isinstance(kb_data, kb_snapshot.CompiledKB):
+        # Room to spare: fill it from every issue, exactly as the JSON KB would
+        kb_snippets, _ = fit_lines(_kb_snippets(user_message, list(kb_data["issues"].values())), budget, MODEL)
+    return _troubleshoot_prompt(user_message, "\n".join(kb_snippets), clarification_mode)
+
+register(LLMTask(
+    "troubleshoot", _build_troubleshoot_prompt,
+    parse=lambda answer, **inputs: None if answer == "NO_KB_MATCH" else answer,
+    # Ollama down or circuit open: answer from the KB alone
+    on_failure=lambda user_message, kb_data, **inputs: kb_answer(user_message, kb_data),
+    cache_ttl=600,
+))
+
+def llm_troubleshoot(user_message, kb_data=None, clarification_mode=False):
+    """KB-grounded troubleshooting advice, or None when the KB has nothing relevant."""
     if is_out_of_scope(user_message):
         return "Sorry, I can only help with washing machine problems. Please describe your washing machine issue."
+    return run_task(
+        "troubleshoot", user_message=user_message, kb_data=kb_data or get_kb(), clarification_mode=clarification_mode
+    )
 
-    kb_snippets = []
-    for issue in kb_data["issues"].values():
-        kb_snippets.append(
-            f"{issue['title']}: {issue['description']} (Keywords: {', '.join(issue['keywords'])})"
-        )
-    kb_text = "\n".join(kb_snippets)
-
-    prompt = f"""
+def _troubleshoot_prompt(user_message, kb_text, clarification_mode):
+    return f"""
 You are a washing machine support assistant.
 
 Rules:
@@ -41,66 +141,3 @@ User Question:
 Knowledge Base:
 {kb_text}
     """
-
-    response = ollama.chat(model='mistral', messages=[
-        {'role': 'user', 'content': prompt}
-    ])
-    answer = response['message']['content'].strip()
-    if answer == "NO_KB_MATCH":
-        return None
-    return answer
-
-def llm_parse_ticket_fields(user_message, projects, categories_by_project):
-    """
-    Parse user message to extract ticket fields using LLM.
-    
-    Args:
-        user_message (str): The user's support request message
-        projects (list): List of project dictionaries containing 'id' and 'name'
-        categories_by_project (dict): Dictionary mapping project IDs to category lists
-        
-    Returns:
-        dict: Parsed ticket fields or None if parsing fails
-    """
-    # Prepare structured context for LLM
-    projects_text = "\n".join([f"- {p['name']}" for p in projects])
-    categories_text = ""
-    for pid, cats in categories_by_project.items():
-        pname = next((p['name'] for p in projects if str(p['id']) == str(pid)), pid)
-        categories_text += f"{pname}: {', '.join([c['name'] for c in cats])}\n"
-
-    prompt = f"""
-You are a customer support assistant for washing machines.  
-Given the user's request, and the available projects and categories, generate a JSON object like:
-
-{{
-  "summary": "...",           // short summary for support staff
-  "description": "...",       // full user message
-  "project_name": "...",      // choose the best project
-  "category_name": "..."      // choose the best category for the problem
-}}
-
-If you cannot confidently pick a category, reply only with: "UNCERTAIN".
-
-Projects:
-{projects_text}
-
-Categories by project:
-{categories_text}
-
-User message:
-\"\"\"{user_message}\"\"\"
-"""
-    response = ollama.chat(model="mistral", messages=[
-        {"role": "user", "content": prompt}
-    ])
-    answer = response['message']['content'].strip()
-    
-    if answer == "UNCERTAIN":
-        return None
-        
-    try:
-        return json.loads(answer)
-    except Exception:
-        return None
-
@@ -0,0 +1,263 @@
+"""
+Compiled, memory-mapped knowledge base snapshots.
+
+    python -m bot.kb_snapshot
+
+compiles bot/knowledge_base.json into bot/kb_snapshots/<version>/ as NumPy
+arrays: one UTF-8 blob holding every string, an offsets table per issue and a
+sorted term table with keyword postings.
+Workers np.load() the arrays with mmap_mode="r", so every process shares the
+same page-cache pages and nothing is parsed up front. CURRENT names the
+published version; readers switch to a newer one when it changes.
+
+NumPy is optional: without it (or without a snapshot) the KB is loaded from
+its JSON source as before.
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+from collections.abc import Mapping
+
+from bot.prompt_budget import words
+
+SNAPSHOT_ROOT = os.path.join(os.path.dirname(__file__), "kb_snapshots")
+FORMAT_VERSION = 1
+FIELDS = ("id", "title", "keywords", "record")
+KEYWORD_SEP = "\x1f"
+MIN_PREFIX = 3       # query words also match indexed terms that are their prefixes ("drain" for "draining")
+KEEP_VERSIONS = 3    # older snapshots are deleted on publish; workers may still map recent ones
+ISSUE_CACHE = 256    # decoded issue records kept per open snapshot
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def _issue_terms(issue):
+    return words(issue["title"]) | words(" ".join(issue["keywords"]))
+
+
+def _sha256(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def build_snapshot(source_path, root=SNAPSHOT_ROOT):
+    """Compile the KB JSON at source_path into a new snapshot directory and publish it. Returns its version."""
+    np = _numpy()
+    if np is None:
+        raise RuntimeError("building a compiled KB snapshot requires numpy")
+    with open(source_path, "rb") as f:
+        raw = f.read()
+    kb = json.loads(raw)
+    issues = list(kb["issues"].values())
+
+    blob = bytearray()
+
+    def put(text):
+        start = len(blob)
+        blob.extend(text.encode("utf-8"))
+        return start, len(blob)
+
+    fields = np.zeros((len(issues), len(FIELDS), 2), dtype=np.int64)
+    postings_by_term = {}
+    for i, issue in enumerate(issues):
+        values = (issue["id"], issue["title"], KEYWORD_SEP.join(issue["keywords"]), json.dumps(issue))
+        for f, value in enumerate(values):
+            fields[i, f] = put(value)
+        for term in _issue_terms(issue):
+            postings_by_term.setdefault(term, []).append(i)
+
+    terms = sorted(postings_by_term)
+    term_offsets = np.array([put(t) for t in terms], dtype=np.int64).reshape(len(terms), 2)
+    postings_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    postings_offsets[1:] = np.cumsum([len(postings_by_term[t]) for t in terms])
+    postings = np.array([i for t in terms for i in postings_by_term[t]], dtype=np.int32)
+
+    source_hash = hashlib.sha256(raw).hexdigest()
+    version = f"{time.strftime('%Y%m%d%H%M%S')}-{source_hash[:8]}"
+    tmp_dir = os.path.join(root, f".{version}.tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
+    np.save(os.path.join(tmp_dir, "blob.npy"), np.frombuffer(bytes(blob), dtype=np.uint8))
+    np.save(os.path.join(tmp_dir, "fields.npy"), fields)
+    np.save(os.path.join(tmp_dir, "terms.npy"), term_offsets)
+    np.save(os.path.join(tmp_dir, "postings_offsets.npy"), postings_offsets)
+    np.save(os.path.join(tmp_dir, "postings.npy"), postings)
+    with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({k: v for k, v in kb.items() if k != "issues"}, f)
+    with open(os.path.join(tmp_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump({
+            "format": FORMAT_VERSION, "version": version, "source_sha256": source_hash,
+            "source_mtime": os.path.getmtime(source_path), "issues": len(issues), "terms": len(terms),
+            "built_at": time.time(),
+        }, f)
+
+    os.replace(tmp_dir, os.path.join(root, version))
+    tmp_current = os.path.join(root, "CURRENT.tmp")
+    with open(tmp_current, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(tmp_current, os.path.join(root, "CURRENT"))
+    _prune(root, keep=version)
+    return version
+
+
+def _prune(root, keep):
+    versions = sorted(d for d in os.listdir(root) if os.path.isdir(os.path.join(root, d)) and not d.startswith("."))
+    for old in versions[:-KEEP_VERSIONS]:
+        if old != keep:
+            shutil.rmtree(os.path.join(root, old), ignore_errors=True)
+
+
+def current_version(root=SNAPSHOT_ROOT):
+    """The published snapshot version, or None. Cheap enough to call on every KB access check."""
+    try:
+        with open(os.path.join(root, "CURRENT"), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def open_current(source_path, root=SNAPSHOT_ROOT):
+    """
+    The published snapshot, memory-mapped, or None when numpy is missing,
+    nothing is published, the format is unknown or the JSON source's content
+    has changed since the snapshot was built.
+    """
+    version = current_version(root)
+    if version is None or _numpy() is None:
+        return None
+    try:
+        kb = CompiledKB(os.path.join(root, version))
+    except (OSError, ValueError) as e:
+        print(f"Ignoring KB snapshot {version}: {e}")
+        return None
+    if os.path.getmtime(source_path) != kb.manifest["source_mtime"] and _sha256(source_path) != kb.manifest["source_sha256"]:
+        # A checkout or deploy moves the mtime without changing the content
+        print(f"Ignoring KB snapshot {version}: {source_path} changed since it was built")
+        return None
+    return kb
+
+
+class IssuesView(Mapping):
+    """kb["issues"] for a compiled snapshot: issue id -> issue dict, decoded on access."""
+
+    def __init__(self, kb):
+        self._kb = kb
+        self._index = None
+
+    def _ids(self):
+        if self._index is None:
+            self._index = {self._kb.field(i, "id"): i for i in range(self._kb.issue_count())}
+        return self._index
+
+    def __getitem__(self, issue_id):
+        return self._kb.issue(self._ids()[issue_id])
+
+    def __iter__(self):
+        return iter(self._ids())
+
+    def __len__(self):
+        return self._kb.issue_count()
+
+
+class CompiledKB(Mapping):
+    """
+    A read-only, memory-mapped KB snapshot. Indexing works like the KB dict
+    (kb["issues"], kb["categories"], ...); candidates() uses the postings to
+    avoid touching every issue.
+    """
+
+    def __init__(self, path):
+        np = _numpy()
+        with open(os.path.join(path, "manifest.json"), "r", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        if self.manifest.get("format") != FORMAT_VERSION:
+            raise ValueError(f"unsupported snapshot format {self.manifest.get('format')}")
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            self._meta = json.load(f)
+
+        def load(name):
+            return np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+
+        self.path = path
+        self.version = self.manifest["version"]
+        self._blob = load("blob")
+        self._fields = load("fields")
+        self._terms = load("terms")
+        self._postings_offsets = load("postings_offsets")
+        self._postings = load("postings")
+        self.issues = IssuesView(self)
+        self._decoded = {}
+
+    def __len__(self):
+        return len(self._meta) + 1  # "issues" plus the top-level meta keys, as in the JSON
+
+    def issue_count(self):
+        return len(self._fields)
+
+    def __getitem__(self, key):
+        return self.issues if key == "issues" else self._meta[key]
+
+    def __iter__(self):
+        return iter(["issues", *self._meta])
+
+    def _text(self, start, end):
+        return self._blob[start:end].tobytes().decode("utf-8")
+
+    def field(self, i, name):
+        start, end = self._fields[i, FIELDS.index(name)]
+        return self._text(start, end)
+
+    def issue(self, i):
+        issue = self._decoded.get(i)
+        if issue is None:
+            if len(self._decoded) >= ISSUE_CACHE:
+                self._decoded.pop(next(iter(self._decoded)))
+            issue = self._decoded[i] = json.loads(self.field(i, "record"))
+        return issue
+
+    def _term_index(self, term):
+        lo, hi = 0, len(self._terms)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._text(*self._terms[mid]) < term:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self._terms) and self._text(*self._terms[lo]) == term:
+            return lo
+        return None
+
+    def candidates(self, text):
+        """Indices of issues sharing a title or keyword term with text, most shared terms first."""
+        hits = {}
+        for word in words(text):
+            matched = set()
+            for length in range(min(MIN_PREFIX, len(word)), len(word) + 1):
+                t = self._term_index(word[:length])
+                if t is not None:
+                    start, end = self._postings_offsets[t], self._postings_offsets[t + 1]
+                    matched.update(int(i) for i in self._postings[start:end])
+            for i in matched:
+                hits[i] = hits.get(i, 0) + 1
+        return sorted(hits, key=lambda i: (-hits[i], i))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compile the knowledge base into a memory-mapped snapshot.")
+    parser.add_argument("--source", help="KB JSON (default: bot/knowledge_base.json)")
+    args = parser.parse_args(argv)
+    from bot.kb import KB_PATH
+    version = build_snapshot(args.source or KB_PATH)
+    print(f"Published KB snapshot {version} in {SNAPSHOT_ROOT}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import os
+
+from bot.circuit import CircuitBreaker
+from bot.prompt_budget import observe
+
+MODEL = os.getenv("OLLAMA_MODEL", "mistral")
+# How long Ollama keeps the weights loaded after the last request
+KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+# Upper bound for one generation; a hung backend should not hold a message forever
+TIMEOUT = float(os.getenv("OLLAMA_TIMEOUT", "60"))
+
+OLLAMA_BREAKER = CircuitBreaker("ollama", window=10, min_calls=3, failure_rate=0.5, open_seconds=30)
+
+_ollama = {}  # clients by timeout
+# Replacement for the Ollama chat call, e.g. the eval harness's recorder; see set_transport()
+_transport = None
+
+
+def _client(timeout=None):
+    # ollama (httpx, pydantic) is imported on first use to keep startup fast
+    timeout = timeout or TIMEOUT
+    if timeout not in _ollama:
+        import ollama
+        _ollama[timeout] = ollama.Client(timeout=timeout)
+    return _ollama[timeout]
+
+
+def set_transport(transport):
+    """
+    Send chat() requests through `transport` instead of Ollama. It is called
+    like ollama.Client.chat and must return a response of the same shape.
+    Pass None to go back to Ollama.
+    """
+    global _transport
+    _transport = transport
+
+
+def llm_available():
+    """False while the Ollama circuit is open; callers should use their degraded path."""
+    return not OLLAMA_BREAKER.is_open
+
+
+def chat(function, prompt, options=None, model=MODEL, timeout=None):
+    """
+    Send a single-turn prompt to the configured Ollama model and return the reply text.
+    `function` names the caller for prompt-token accounting; `timeout` overrides
+    OLLAMA_TIMEOUT for this call. Raises CircuitOpenError without calling
+    Ollama while its circuit is open.
+    """
+    kwargs = {"options": options} if options else {}
+    response = OLLAMA_BREAKER.call(
+        _transport or _client(timeout).chat,
+        model=model, messages=[{"role": "user", "content": prompt}], keep_alive=KEEP_ALIVE, **kwargs
+    )
+    observe(function, model, prompt, response.get("prompt_eval_count"))
+    return response['message']['content']
+
+
+def prewarm(model=MODEL):
+    """Load the model weights into Ollama without generating anything."""
+    OLLAMA_BREAKER.call(_client().generate, model=model, prompt="", keep_alive=KEEP_ALIVE)
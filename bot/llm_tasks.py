@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from bot.llm import MODEL, chat
+
+CACHE_SIZE = 512  # LRU bound on cached task results, across all tasks
+LOG_EVERY = 100   # task runs between stats log lines
+
+_tasks = {}
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_stats = {}
+_runs = 0
+
+
+class InvalidOutput(ValueError):
+    """The model's answer does not match the task's output schema."""
+
+
+class LLMTask:
+    """
+    Declaration of one kind of LLM call. run_task() does the rest: building
+    the prompt, caching, the call itself, output validation, fallbacks and
+    metrics, identically for every task.
+
+    prompt      callable(**inputs) -> prompt text
+    output      "text", or "json" to decode the answer (code fences stripped)
+    required    keys a JSON object answer must have
+    parse       optional callable(answer, **inputs) -> result; raises
+                InvalidOutput (or ValueError) when the answer is unusable
+    on_invalid  result when the answer is invalid
+    on_failure  callable(**inputs) -> result when the call fails (Ollama down,
+                circuit open, timeout); None re-raises the error
+    cache_ttl   seconds an identical prompt's result is reused; 0 disables
+    timeout     seconds for the Ollama call; None uses OLLAMA_TIMEOUT
+    model       defaults to OLLAMA_MODEL_<NAME>, then OLLAMA_MODEL
+    """
+
+    def __init__(self, name, prompt, output="text", required=(), parse=None, options=None,
+                 on_invalid=None, on_failure=None, cache_ttl=0, timeout=None, model=None):
+        self.name = name
+        self.prompt = prompt
+        self.output = output
+        self.required = tuple(required)
+        self.parse = parse
+        self.options = options
+        self.on_invalid = on_invalid
+        self.on_failure = on_failure
+        self.cache_ttl = cache_ttl
+        self.timeout = timeout
+        self.model = model or os.getenv(f"OLLAMA_MODEL_{name.upper()}", MODEL)
+
+
+def register(task):
+    _tasks[task.name] = task
+    return task
+
+
+def get_task(name):
+    return _tasks[name]
+
+
+def _decode(task, answer, inputs):
+    if task.output == "json":
+        answer = answer.replace("```json", "").replace("```", "").strip()
+        try:
+            answer = json.loads(answer)
+        except ValueError:
+            raise InvalidOutput(f"{task.name}: answer is not JSON")
+        if task.required:
+            if not isinstance(answer, dict) or any(k not in answer for k in task.required):
+                raise InvalidOutput(f"{task.name}: answer lacks {', '.join(task.required)}")
+    return task.parse(answer, **inputs) if task.parse else answer
+
+
+def _cache_key(task, prompt):
+    raw = json.dumps([task.name, task.model, task.options or {}, prompt], sort_keys=True)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def _cached(key):
+    with _cache_lock:
+        hit = _cache.get(key)
+        if hit is None:
+            return None
+        if hit[0] < time.monotonic():
+            del _cache[key]
+            return None
+        _cache.move_to_end(key)
+        return hit
+
+
+def _store(key, ttl, result):
+    with _cache_lock:
+        _cache[key] = (time.monotonic() + ttl, result)
+        _cache.move_to_end(key)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
+
+
+def _count(name, outcome, latency=0.0):
+    global _runs
+    stats = _stats.setdefault(name, {"runs": 0, "cache_hits": 0, "ok": 0, "invalid": 0, "failed": 0, "llm_seconds": 0.0})
+    stats["runs"] += 1
+    stats[outcome] += 1
+    stats["llm_seconds"] += latency
+    _runs += 1
+    if _runs % LOG_EVERY == 0:
+        print("llm tasks: " + "; ".join(
+            f"{n} runs={s['runs']} hits={s['cache_hits']} invalid={s['invalid']} failed={s['failed']} "
+            f"avg={s['llm_seconds'] / max(1, s['runs'] - s['cache_hits']):.2f}s"
+            for n, s in _stats.items()
+        ))
+
+
+def task_stats():
+    """Per-task run counts, cache hits, invalid answers, failures and time spent in the model."""
+    return {name: dict(stats) for name, stats in _stats.items()}
+
+
+def run_task(name, **inputs):
+    """Run a registered task on `inputs` and return its parsed result."""
+    task = _tasks[name]
+    prompt = task.prompt(**inputs)
+    key = _cache_key(task, prompt) if task.cache_ttl else None
+    if key:
+        hit = _cached(key)
+        if hit:
+            _count(name, "cache_hits")
+            return hit[1]
+
+    started = time.perf_counter()
+    try:
+        answer = chat(name, prompt, options=task.options, model=task.model, timeout=task.timeout).strip()
+    except Exception:
+        _count(name, "failed", time.perf_counter() - started)
+        if task.on_failure is None:
+            raise
+        return task.on_failure(**inputs)
+    latency = time.perf_counter() - started
+
+    try:
+        result = _decode(task, answer, inputs)
+    except ValueError:
+        _count(name, "invalid", latency)
+        return task.on_invalid
+    _count(name, "ok", latency)
+    if key:
+        _store(key, task.cache_ttl, result)
+    return result
@@ -1,94 +1,151 @@
-import ollama
-import json
+import re
 from typing import Dict, List, Optional
 
-def llm_route(user_message, session):
-    last_problem = session.get("problem", "")
-    clarification_asked = session.get("clarification_asked", False)
-    state = session.get("state", "")
-    ticket_ids = session.get("tickets", [])
-
-    prompt = f"""
-You are a controller for a washing machine support bot. 
-Your job is to classify the user's request into a structured action that downstream code will execute. 
-Always reply with a compact JSON object of the form: {{"action": "<action>", "info": "<optional details>"}}
-Never reply with explanations, only the JSON.
-
-[ACTIONS AND EXAMPLES]
+from bot.llm import MODEL
+from bot.llm_tasks import InvalidOutput, LLMTask, register, run_task
+from bot.prompt_budget import count_tokens, fit_lines, rank_by_relevance, remaining, trim_text
+
+LAST_PROBLEM_TOKENS = 80
+PROBLEM_TOKENS = 300  # longest problem text sent to parse_fields; the category list needs the rest
+
+# Keyword rules for routing while the LLM is unavailable, checked in order
+KEYWORD_ROUTES = [
+    ("security", ["api key", "password", "token", "admin access", "bypass", "sql", "export all", "users' data"]),
+    ("ticket_status", ["status", "any update", "an update", "update on", "progress", "my tickets", "all tickets", "show tickets"]),
+    ("create_ticket", ["raise a ticket", "create a ticket", "open a ticket", "support case", "contact support", "talk to support", "report this"]),
+]
+# Only checked once the KB has no match, so "help, water is leaking" gets troubleshooting
+HELP_PHRASES = ["help", "how do i use", "commands", "what can you do"]
+# Keywords can't tell "close ticket 5" from "the lid won't close", so close and
+# delete phrasing about a ticket only ever leads to a yes/no confirmation
+CONFIRM_ROUTES = [
+    ("confirm_delete_ticket", re.compile(r"\b(?:delete|remove|cancel)\b")),
+    ("confirm_close_ticket", re.compile(r"\b(?:close|resolve|resolved|mark)\b")),
+]
+TICKET_REFERENCE = re.compile(r"\b(?:ticket|tickets|case|request)\b|#\s*\d+")
+GREETINGS = {"hi", "hello", "hey", "thanks", "thank you", "bye", "good morning", "good evening", "see you"}
+
+
+def keyword_route(user_message, session):
+    """Cheap stand-in for llm_route used when the LLM is unavailable. Never routes to a destructive action."""
+    from bot.kb import is_out_of_scope, kb_search
+
+    text = user_message.lower().strip()
+    if text.strip("!.? ") in GREETINGS:
+        return {"action": "greeting", "info": ""}
+    if TICKET_REFERENCE.search(text):
+        for action, pattern in CONFIRM_ROUTES:
+            if pattern.search(text):
+                return {"action": action, "info": ""}
+    for action, phrases in KEYWORD_ROUTES:
+        if any(phrase in text for phrase in phrases):
+            return {"action": action, "info": ""}
+    if text in ("no", "n"):
+        return {"action": "create_ticket", "info": ""}
+    if is_out_of_scope(text):
+        return {"action": "out_of_scope", "info": ""}
+    if kb_search(text):
+        return {"action": "kb_answer", "info": ""}
+    if any(phrase in text for phrase in HELP_PHRASES):
+        return {"action": "help", "info": ""}
+    if len(text.split()) >= 4:
+        return {"action": "kb_answer", "info": ""}
+    return {"action": "clarify", "info": ""}
+
+ROUTE_ACTIONS = {
+    "help", "greeting", "clarify", "kb_answer", "create_ticket", "ticket_status",
+    "close_ticket", "delete_ticket", "out_of_scope", "security",
+}
+
+# Static parts of the router prompt, shared by single and batched routing
+ROUTE_GUIDE = """[ACTIONS AND EXAMPLES]
 help:
   - User asks for help, "how do I use this?", "show help", "commands", "what can you do?"
-  - Output: {{"action": "help"}}
+  - Output: {"action": "help"}
 
 greeting:
   - "hi", "hello", "thanks", "good morning", "thank you", "bye", "see you"
-  - Output: {{"action": "greeting"}}
+  - Output: {"action": "greeting"}
 
 clarify:
   - You don't have enough detail about the washing machine issue.
   - "it's not working", "problem", "help me" (but with no detail), "can you help?", or any message that needs clarification.
   - (Only ask to clarify once per session! Use clarification_asked to avoid looping.)
-  - Output: {{"action": "clarify"}}
+  - Output: {"action": "clarify"}
 
 kb_answer:
   - User describes a washing machine problem, and you have enough detail to search for solutions.
   - "water is leaking", "door is jammed", "machine makes noise", "won't start", etc.
-  - Output: {{"action": "kb_answer"}}
+  - Output: {"action": "kb_answer"}
 
 create_ticket:
   - User says "raise a ticket", "open support case", "I want to talk to support", "report this", "contact support", "please create a ticket", etc.
   - Also use if user says "no" to troubleshooting and needs escalation.
-  - Output: {{"action": "create_ticket"}}
+  - Output: {"action": "create_ticket"}
 
 ticket_status:
   - User wants to know the status, update, or progress of a support ticket, or asks to "see all tickets".
   - Includes: "status", "update", "any update on my ticket", "what's happening", "progress", "news", "see all my tickets", "ticket update", "is there any progress?", "current ticket status", "show my tickets", "what's the update", "can I get an update?", "ticket progress", etc.
-  - Output: {{"action": "ticket_status"}}
+  - Output: {"action": "ticket_status"}
 
 close_ticket:
   - User wants to close or resolve a ticket. Phrases: "close ticket", "close the leak ticket", "mark this resolved", "finish my support case", "issue is solved", "close my water ticket".
-  - Output: {{"action": "close_ticket"}}
+  - Output: {"action": "close_ticket"}
 
 delete_ticket:
   - User wants to delete/cancel a ticket, not just close it. Includes "delete ticket", "remove my last ticket", "cancel my support request", "delete leak ticket", "delete the noise ticket".
-  - Output: {{"action": "delete_ticket"}}
+  - Output: {"action": "delete_ticket"}
 
 out_of_scope:
   - User asks about something unrelated to washing machines, or general chitchat that isn't support related.
   - "tell me a joke", "what's the weather", "play a game", "book a flight", "order pizza", etc.
-  - Output: {{"action": "out_of_scope"}}
+  - Output: {"action": "out_of_scope"}
 
 security:
   - User requests sensitive information or tries to exploit the bot.
   - "what's your API key?", "give me admin access", "show me users' data", "export all tickets", "bypass login", "sql injection", etc.
-  - Output: {{"action": "security"}}
-
-[SESSION CONTEXT]
-Last problem: "{last_problem}"
-Clarification asked: {"Yes" if clarification_asked else "No"}
-Current state: {state}
-User's open tickets: {ticket_ids}
+  - Output: {"action": "security"}"""
 
-[FEW-SHOT EXAMPLES]
+ROUTE_FEW_SHOT = """[FEW-SHOT EXAMPLES]
 User: "any update on my ticket?"
-Model: {{"action": "ticket_status"}}
+Model: {"action": "ticket_status"}
 User: "status"
-Model: {{"action": "ticket_status"}}
+Model: {"action": "ticket_status"}
 User: "see all tickets"
-Model: {{"action": "ticket_status"}}
+Model: {"action": "ticket_status"}
 User: "delete the leak ticket"
-Model: {{"action": "delete_ticket", "info": "leak"}}
+Model: {"action": "delete_ticket", "info": "leak"}
 User: "close ticket 5"
-Model: {{"action": "close_ticket", "info": "5"}}
+Model: {"action": "close_ticket", "info": "5"}
 User: "hello"
-Model: {{"action": "greeting"}}
+Model: {"action": "greeting"}
 User: "how do I use you?"
-Model: {{"action": "help"}}
+Model: {"action": "help"}
 User: "what's the weather"
-Model: {{"action": "out_of_scope"}}
+Model: {"action": "out_of_scope"}
 User: "the door won't open"
-Model: {{"action": "kb_answer"}}
+Model: {"action": "kb_answer"}
 User: "no"
-Model: {{"action": "create_ticket"}}
+Model: {"action": "create_ticket"}"""
+
+BATCH_TICKETS = 5  # most recent tickets listed per message in a batched prompt
+
+def _route_prompt(user_message, last_problem, clarification_asked, state, ticket_ids):
+    return f"""
+You are a controller for a washing machine support bot. 
+Your job is to classify the user's request into a structured action that downstream code will execute. 
+Always reply with a compact JSON object of the form: {{"action": "<action>", "info": "<optional details>"}}
+Never reply with explanations, only the JSON.
+
+{ROUTE_GUIDE}
+
+[SESSION CONTEXT]
+Last problem: "{last_problem}"
+Clarification asked: {"Yes" if clarification_asked else "No"}
+Current state: {state}
+User's open tickets: {ticket_ids}
+
+{ROUTE_FEW_SHOT}
 
 [INSTRUCTIONS]
 - Respond ONLY with a single-line JSON object as specified above.
@@ -98,32 +155,164 @@ Model: {{"action": "create_ticket"}}
 "{user_message}"
 """
 
-    response = ollama.chat(model="mistral", messages=[{"role": "user", "content": prompt}])
-    answer = response['message']['content'].strip()
-    # Defensive: sometimes model adds ```json or backticks, so strip those
-    answer = answer.replace("```json", "").replace("```", "").strip()
-    try:
-        return json.loads(answer)
-    except Exception:
-        # fallback to clarify if parse error
-        return {"action": "clarify", "info": ""}
+def _build_route_prompt(user_message, session):
+    last_problem = trim_text(session.get("problem", ""), LAST_PROBLEM_TOKENS, MODEL)
+    clarification_asked = session.get("clarification_asked", False)
+    state = session.get("state", "")
+
+    # Most recent tickets first, as many as fit in what the static prompt leaves over
+    base = _route_prompt(user_message, last_problem, clarification_asked, state, [])
+    ticket_ids = [str(t.get("id") if isinstance(t, dict) else t) for t in reversed(session.get("tickets", []))]
+    kept, _ = fit_lines(ticket_ids, remaining("route", base, model=MODEL), MODEL)
+    return _route_prompt(user_message, last_problem, clarification_asked, state, [int(t) for t in kept])
+
+
+def _check_action(answer, **inputs):
+    if answer["action"] not in ROUTE_ACTIONS:
+        raise InvalidOutput(f"unknown action {answer['action']!r}")
+    return answer
+
+
+register(LLMTask(
+    "route", _build_route_prompt, output="json", required=("action",), parse=_check_action,
+    # Unparseable answer: ask the user; Ollama down or circuit open: route on keywords instead of stalling
+    on_invalid={"action": "clarify", "info": ""}, on_failure=keyword_route, timeout=20,
+))
+
+
+def llm_route(user_message, session):
+    return run_task("route", user_message=user_message, session=session)
+
+
+def _batch_route_prompt(items):
+    # Each message gets an equal share of what the static prompt leaves of the route_batch budget
+    share = remaining("route_batch", _batch_prompt(len(items), ""), model=MODEL) // max(1, len(items))
+    entries = []
+    for n, (user_message, session) in enumerate(items, 1):
+        last_problem = trim_text(session.get("problem", ""), LAST_PROBLEM_TOKENS, MODEL)
+        tickets = [t.get("id") if isinstance(t, dict) else t for t in session.get("tickets", [])][-BATCH_TICKETS:]
+        context = (
+            f"{n}. Context: last problem \"{last_problem}\"; "
+            f"clarification asked: {'Yes' if session.get('clarification_asked', False) else 'No'}; "
+            f"state: {session.get('state', '')}; open tickets: {tickets}\n"
+        )
+        message = trim_text(user_message, max(1, share - count_tokens(context + '   Message: ""', MODEL) - 1), MODEL)
+        entries.append(f"{context}   Message: \"{message}\"")
+    return _batch_prompt(len(items), "\n".join(entries))
+
+
+def _batch_prompt(count, messages_text):
+    return f"""
+You are a controller for a washing machine support bot.
+Classify EACH numbered user message below into a structured action that downstream code will execute.
+Every message comes from a different user and has its own session context.
+
+{ROUTE_GUIDE}
+
+{ROUTE_FEW_SHOT}
+
+[MESSAGES]
+{messages_text}
+
+[INSTRUCTIONS]
+- Respond ONLY with a JSON array of exactly {count} objects, one per message, in order:
+  [{{"id": 1, "action": "<action>", "info": "<optional details>"}}, ...]
+- Do NOT explain or add anything else.
+"""
+
+
+def _align_batch(answer, items):
+    if not isinstance(answer, list):
+        raise InvalidOutput("batched answer is not a JSON array")
+    by_id = {}
+    for position, entry in enumerate(answer, 1):
+        if isinstance(entry, dict):
+            by_id.setdefault(entry.get("id", position), entry)
+    results = []
+    for n in range(1, len(items) + 1):
+        entry = by_id.get(n)
+        if entry and entry.get("action") in ROUTE_ACTIONS:
+            results.append({"action": entry["action"], "info": entry.get("info", "")})
+        else:
+            results.append(None)
+    return results
+
+
+register(LLMTask("route_batch", _batch_route_prompt, output="json", parse=_align_batch, timeout=30))
+
+
+def llm_route_batch(items):
+    """
+    Route several (user_message, session) pairs with one LLM call.
+    Returns a list aligned with items; an entry is None where the model's
+    answer for that message was missing or invalid. Raises if the call fails.
+    """
+    return run_task("route_batch", items=items) or [None] * len(items)
+
+
+
+
+def _build_parse_fields_prompt(problem_desc, projects, categories_by_project):
+    problem_desc = trim_text(problem_desc, PROBLEM_TOKENS, MODEL)
+    projects_text, categories_text = _catalog_sections(problem_desc, projects, categories_by_project)
+    return _parse_fields_prompt(problem_desc, projects_text, categories_text)
 
 
+def _check_project(answer, projects, **inputs):
+    if not any(p['name'] == answer['project_name'] for p in projects):
+        raise InvalidOutput(f"unknown project {answer['project_name']!r}")
+    return answer
+
+
+register(LLMTask(
+    "parse_fields", _build_parse_fields_prompt, output="json",
+    required=("summary", "description", "project_name", "category_name"), parse=_check_project,
+    options={"temperature": 0.2},  # More precise
+    # Creating again after a duplicate warning re-parses the same problem
+    cache_ttl=300, timeout=30, on_failure=lambda **inputs: None,
+))
 
 
 def llm_parse_ticket_fields(problem_desc: str, projects: List[Dict], categories_by_project: Dict) -> Optional[Dict]:
     """
     Improved ticket field parsing with washing machine-specific guidance.
     Returns: {"summary": "...", "description": "...", "project_name": "...", "category_name": "..."}
+    or None when the answer is unusable or names an unknown project.
+    """
+    return run_task(
+        "parse_fields", problem_desc=problem_desc, projects=projects, categories_by_project=categories_by_project
+    )
+
+
+def _catalog_sections(problem_desc: str, projects: List[Dict], categories_by_project: Dict):
     """
+    Render the project and category lists for the parse prompt, most relevant
+    to the problem first. Every category of the best matching project is kept;
+    other projects' categories are trimmed to the parse_fields budget.
+    """
+    names = {str(p['id']): p['name'] for p in projects}
     projects_text = "\n".join([f"- {p['name']} (ID: {p['id']})" for p in projects])
-    
+
+    # Rank every (project, category) pair against the problem; the top pair names the matched project
+    pairs = [(pid, c['name']) for pid, cats in categories_by_project.items() for c in cats]
+    ranked = rank_by_relevance(problem_desc, pairs, key=lambda pair: pair[1])
+    matched = [pair for pair in ranked if ranked and pair[0] == ranked[0][0]]
+    others = [pair for pair in ranked if pair not in matched]
+    base = _parse_fields_prompt(problem_desc, projects_text, "\n".join(f"  - {name}" for _, name in matched))
+    lines, _ = fit_lines([f"  - {name}" for _, name in others], remaining("parse_fields", base, model=MODEL), MODEL)
+    kept = matched + others[:len(lines)]
+
     categories_text = ""
-    for pid, cats in categories_by_project.items():
-        pname = next((p['name'] for p in projects if str(p['id']) == str(pid)), f"Project {pid}")
-        categories_text += f"{pname}:\n" + "\n".join([f"  - {c['name']}" for c in cats]) + "\n"
+    for pid in categories_by_project:
+        cats = [name for kept_pid, name in kept if kept_pid == pid]
+        if cats:
+            pname = names.get(str(pid), f"Project {pid}")
+            categories_text += f"{pname}:\n" + "\n".join([f"  - {name}" for name in cats]) + "\n"
+    return projects_text, categories_text
 
-    prompt = f"""
+
+def _parse_fields_prompt(problem_desc, projects_text, categories_text):
+    return f"""
 You're a washing machine support specialist creating a ticket. Extract:
 
 1. Concise technical summary (under 60 chars)
@@ -148,21 +337,25 @@ Reply ONLY with JSON like this:
   "category_name": "Exact category name match"
 }}
 """
-    try:
-        response = ollama.chat(
-            model="mistral",
-            messages=[{"role": "user", "content": prompt}],
-            options={"temperature": 0.2}  # More precise
-        )
-        result = json.loads(response['message']['content'])
-        
-        # Validate project exists
-        if not any(p['name'] == result['project_name'] for p in projects):
-            return None
-            
-        return result
-    except Exception:
-        return None
+
+
+def _build_pick_ticket_prompt(user_command, open_tickets):
+    # Most recent tickets first, trimmed to the pick_ticket budget
+    lines = [
+        f"ID: {t['id']} | Summary: {t.get('summary','')} | Category: {t.get('category','')} "
+        f"| Status: {t.get('status','')} | Created: {t.get('created_at','')}"
+        for t in reversed(open_tickets)
+    ]
+    kept, _ = fit_lines(lines, remaining("pick_ticket", _pick_ticket_prompt(user_command, ""), model=MODEL), MODEL)
+    return _pick_ticket_prompt(user_command, "\n".join(kept))
+
+
+register(LLMTask(
+    "pick_ticket", _build_pick_ticket_prompt,
+    parse=lambda answer, **inputs: int(answer) if answer.isdigit() else None,
+    options={"temperature": 0.1},  # Highly deterministic
+    timeout=15, on_failure=lambda **inputs: None,
+))
 
 
 def llm_pick_ticket_id(user_command: str, open_tickets: List[Dict]) -> Optional[int]:
@@ -170,12 +363,11 @@ def llm_pick_ticket_id(user_command: str, open_tickets: List[Dict]) -> Optional[
     Enhanced ticket ID detection from natural language commands.
     Returns ticket ID if confident match found.
     """
-    tickets_text = "\n".join([
-        f"ID: {t['id']} | Summary: {t.get('summary','')} | Created: {t.get('created_at','')}"
-        for t in open_tickets
-    ])
+    return run_task("pick_ticket", user_command=user_command, open_tickets=open_tickets)
 
-    prompt = f"""
+
+def _pick_ticket_prompt(user_command, tickets_text):
+    return f"""
 User wants to reference a washing machine support ticket. Identify which one:
 
 [USER COMMAND]
@@ -193,49 +385,3 @@ Respond with either:
 - The ticket ID number (e.g., 123)
 - "null" if uncertain
 """
-    try:
-        response = ollama.chat(
-            model="mistral",
-            messages=[{"role": "user", "content": prompt}],
-            options={"temperature": 0.1}  # Highly deterministic
-        )
-        content = response['message']['content'].strip()
-        return int(content) if content.isdigit() else None
-    except Exception:
-        return None
-
-
-def llm_troubleshoot(problem: str, clarification_mode: bool = False) -> Optional[str]:
-    """
-    Enhanced washing machine troubleshooting with step-by-step guidance.
-    Returns formatted troubleshooting steps or None if escalation needed.
-    """
-    prompt = f"""
-As a washing machine technician, provide troubleshooting steps for:
-
-[PROBLEM]
-{problem}
-
-Guidelines:
-1. Provide 3-5 clear steps
-2. Include safety warnings if needed
-3. If problem requires professional help, state that
-4. Format with clear numbering
-5. Keep response under 300 characters
-
-{"[NOTE] User already provided clarification" if clarification_mode else ""}
-
-Respond with either:
-- Detailed troubleshooting steps
-- "ESCALATE" if professional help needed
-"""
-    try:
-        response = ollama.chat(
-            model="mistral",
-            messages=[{"role": "user", "content": prompt}],
-            options={"temperature": 0.5}
-        )
-        content = response['message']['content'].strip()
-        return None if "ESCALATE" in content else content
-    except Exception:
-        return None
\ No newline at end of file
@@ -0,0 +1,167 @@
+import asyncio
+import time
+
+MAX_MESSAGE_LEN = 2000  # Discord's hard limit per message
+COALESCE_WINDOW = 0.05  # seconds to wait for more text to the same channel
+# Client-side pacing that stays under Discord's buckets, so the library never
+# has to back off on a 429 (which stalls every send sharing that bucket).
+CHANNEL_RATE = (5, 5.0)   # messages per seconds, per channel
+GLOBAL_RATE = (45, 1.0)   # messages per seconds, whole bot
+MAX_RETRIES = 2
+
+
+def chunk_message(text, limit=MAX_MESSAGE_LEN):
+    """
+    Split text into pieces of at most `limit` characters, breaking on line
+    boundaries where possible and on spaces for lines that are too long.
+    """
+    chunks = []
+    current = ""
+    for line in text.split("\n"):
+        while len(line) > limit:
+            cut = line.rfind(" ", 0, limit)
+            cut = cut if cut > 0 else limit
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(line[:cut])
+            line = line[cut:].lstrip(" ")
+        candidate = f"{current}\n{line}" if current else line
+        if len(candidate) > limit:
+            chunks.append(current)
+            current = line
+        else:
+            current = candidate
+    if current.strip():
+        chunks.append(current)
+    return [c for c in chunks if c.strip()]
+
+
+def format_ticket_history(tid, summary, status, category, notes, max_notes=3, total_notes=None):
+    """
+    One ticket's status block. `notes` are the updates to show (typically the
+    ones not seen before), of which only the latest `max_notes` are listed.
+    """
+    total_notes = len(notes) if total_notes is None else total_notes
+    text = f"\n――――――――――\nID: `{tid}` | {summary} | Status: {status} | Category: {category}"
+    if notes:
+        shown = notes[-max_notes:]
+        text += "\nUpdates:\n" + "\n".join(f"- {n.get('text', '')}" for n in shown)
+        if total_notes > len(shown):
+            text += f"\n_(+{total_notes - len(shown)} earlier updates)_"
+    elif total_notes:
+        text += f"\n_No new updates ({total_notes} earlier)_"
+    return text
+
+
+class RateBucket:
+    """Token bucket allowing `rate` sends per `per` seconds; acquire() waits for a slot."""
+
+    def __init__(self, rate, per):
+        self.rate = rate
+        self.per = per
+        self.tokens = float(rate)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate / self.per)
+        self.updated = now
+
+    async def acquire(self):
+        while True:
+            self._refill()
+            wait = self.blocked_until - time.monotonic()
+            if wait <= 0 and self.tokens >= 1:
+                self.tokens -= 1
+                return
+            if wait <= 0:
+                wait = (1 - self.tokens) * self.per / self.rate
+            await asyncio.sleep(wait)
+
+    def try_acquire(self):
+        """Take a slot if one is free right now, without waiting."""
+        self._refill()
+        if self.blocked_until <= time.monotonic() and self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def retry_in(self):
+        """Seconds until the next slot frees up."""
+        self._refill()
+        wait = max(0.0, self.blocked_until - time.monotonic())
+        return max(wait, (1 - self.tokens) * self.per / self.rate)
+
+    @property
+    def full(self):
+        self._refill()
+        return self.tokens >= self.rate
+
+    def block(self, seconds):
+        """Honour a retry_after reported by Discord."""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+
+class Outbox:
+    """
+    Outbound message layer. send() queues text for a channel; queued text is
+    merged and re-chunked to Discord's size limit, then delivered in order,
+    paced per channel and globally. Call flush() at the end of a handler to
+    deliver right away, otherwise a short timer flushes.
+    """
+
+    def __init__(self):
+        self._pending = {}
+        self._timers = {}
+        self._locks = {}
+        self._buckets = {}
+        self._global = RateBucket(*GLOBAL_RATE)
+        self.stats = {"queued": 0, "sent": 0, "coalesced": 0, "rate_limited": 0, "failed": 0}
+
+    def send(self, channel, text):
+        if not text:
+            return
+        key = channel.id
+        self._pending.setdefault(key, (channel, []))[1].append(text)
+        self.stats["queued"] += 1
+        if key not in self._timers:
+            self._timers[key] = asyncio.get_running_loop().call_later(
+                COALESCE_WINDOW, lambda: asyncio.ensure_future(self.flush(channel))
+            )
+
+    async def flush(self, channel):
+        key = channel.id
+        timer = self._timers.pop(key, None)
+        if timer:
+            timer.cancel()
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            _, texts = self._pending.pop(key, (channel, []))
+            if not texts:
+                return
+            chunks = chunk_message("\n\n".join(texts))
+            self.stats["coalesced"] += max(0, len(texts) - len(chunks))
+            bucket = self._buckets.setdefault(key, RateBucket(*CHANNEL_RATE))
+            for chunk in chunks:
+                await self._deliver(channel, bucket, chunk)
+
+    async def _deliver(self, channel, bucket, chunk):
+        for _ in range(MAX_RETRIES + 1):
+            await bucket.acquire()
+            await self._global.acquire()
+            try:
+                await channel.send(chunk)
+                self.stats["sent"] += 1
+                return
+            except Exception as e:
+                retry_after = getattr(e, "retry_after", None)
+                if getattr(e, "status", None) == 429 and retry_after:
+                    self.stats["rate_limited"] += 1
+                    bucket.block(retry_after)
+                    continue
+                print(f"Failed to send message to channel {channel.id}: {e}")
+                break
+        self.stats["failed"] += 1
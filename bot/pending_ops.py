@@ -0,0 +1,89 @@
+import asyncio
+import os
+import json
+import time
+
+from bot.duplicates import forget_ticket
+from bot.user_tickets import remove_ticket_for_user, update_ticket_status_for_user
+from mantishub.exceptions import MantisHubUnavailable
+
+PENDING_OPS_PATH = os.path.join(os.path.dirname(__file__), "pending_ops.json")
+
+MAX_ATTEMPTS = 5  # an op that keeps failing for reasons other than an outage is dropped
+
+
+def _load_ops():
+    if not os.path.exists(PENDING_OPS_PATH):
+        return []
+    with open(PENDING_OPS_PATH, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _save_ops(ops):
+    with open(PENDING_OPS_PATH, "w", encoding="utf-8") as f:
+        json.dump(ops, f)
+
+
+def enqueue_op(op, user_id, **fields):
+    """Queue a ticket operation ("create", "close", "delete", "note") to run once MantisHub is back."""
+    ops = _load_ops()
+    ops.append({"id": time.time_ns(), "op": op, "user_id": str(user_id), "attempts": 0, **fields})
+    _save_ops(ops)
+
+
+def pending_ops(user_id=None):
+    ops = _load_ops()
+    return [o for o in ops if user_id is None or o["user_id"] == str(user_id)]
+
+
+def _finish(op_id):
+    _save_ops([o for o in _load_ops() if o["id"] != op_id])
+
+
+def _bump(op_id):
+    ops = _load_ops()
+    for o in ops:
+        if o["id"] == op_id:
+            o["attempts"] += 1
+    _save_ops([o for o in ops if o["attempts"] < MAX_ATTEMPTS])
+
+
+async def _replay(op, ticket_service):
+    mh_client = ticket_service.mh_client
+    user_id = op["user_id"]
+    if op["op"] == "create":
+        return await ticket_service.replay_create(op)
+    if op["op"] == "note":
+        await asyncio.to_thread(mh_client.add_note_to_ticket, op["ticket_id"], op["text"])
+        return f"📝 Your queued update was added to ticket `{op['ticket_id']}`."
+    if op["op"] == "close":
+        await asyncio.to_thread(mh_client.update_ticket, op["ticket_id"], {"status": {"id": 90}})
+        update_ticket_status_for_user(user_id, op["ticket_id"], "closed")
+        forget_ticket(op["ticket_id"])
+        return f"✅ Ticket `{op['ticket_id']}` closed."
+    if op["op"] == "delete":
+        await asyncio.to_thread(mh_client.delete_ticket, op["ticket_id"])
+        remove_ticket_for_user(user_id, op["ticket_id"])
+        forget_ticket(op["ticket_id"])
+        return f"🗑️ Ticket `{op['ticket_id']}` deleted."
+    raise ValueError(f"Unknown queued op: {op['op']}")
+
+
+async def replay_pending(ticket_service, notify):
+    """
+    Run queued operations in order. Stops at the first MantisHubUnavailable so
+    the rest stay queued for the next attempt. `notify(user_id, text)` is
+    awaited with the outcome of each op.
+    """
+    for op in _load_ops():
+        try:
+            text = await _replay(op, ticket_service)
+        except MantisHubUnavailable:
+            return
+        except Exception as e:
+            print(f"Queued {op['op']} for user {op['user_id']} failed: {e}")
+            _bump(op["id"])
+            continue
+        _finish(op["id"])
+        if text:
+            await notify(op["user_id"], text)
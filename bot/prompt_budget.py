@@ -0,0 +1,115 @@
+import re
+
+# Prompt-token budgets per LLM function. Static instructions are always kept;
+# dynamic sections (tickets, categories, KB entries) are trimmed to fit.
+BUDGETS = {
+    "route": 1400,
+    "route_batch": 4000,
+    "parse_fields": 700,
+    "pick_ticket": 450,
+    "troubleshoot": 1200,
+}
+
+# Starting chars-per-token guesses; refined from Ollama's prompt_eval_count.
+DEFAULT_CHARS_PER_TOKEN = {"mistral": 3.4}
+FALLBACK_CHARS_PER_TOKEN = 3.5
+CALIBRATION_WEIGHT = 0.2
+STATS_WINDOW = 500
+LOG_EVERY = 50
+
+_chars_per_token = dict(DEFAULT_CHARS_PER_TOKEN)
+_samples = {}
+_calls = {}
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def _model_key(model):
+    return model.split(":")[0]
+
+
+def count_tokens(text, model="mistral"):
+    """Estimated token count of `text` for `model`."""
+    if not text:
+        return 0
+    ratio = _chars_per_token.get(_model_key(model), FALLBACK_CHARS_PER_TOKEN)
+    return int(len(text) / ratio) + 1
+
+
+def observe(function, model, prompt, prompt_tokens=None):
+    """
+    Record the prompt size of one call. When the backend reports the real
+    prompt_eval_count, the model's chars-per-token ratio is recalibrated.
+    """
+    key = _model_key(model)
+    if prompt_tokens:
+        measured = len(prompt) / prompt_tokens
+        current = _chars_per_token.get(key, FALLBACK_CHARS_PER_TOKEN)
+        _chars_per_token[key] = current + CALIBRATION_WEIGHT * (measured - current)
+    else:
+        prompt_tokens = count_tokens(prompt, model)
+
+    samples = _samples.setdefault(function, [])
+    samples.append(prompt_tokens)
+    if len(samples) > STATS_WINDOW:
+        del samples[0]
+    _calls[function] = _calls.get(function, 0) + 1
+    if _calls[function] % LOG_EVERY == 0:
+        s = prompt_stats()[function]
+        print(f"prompt tokens [{function}] n={s['count']} p50={s['p50']} p95={s['p95']} max={s['max']}")
+
+
+def prompt_stats():
+    """Per-function distribution of prompt tokens over the recent window."""
+    stats = {}
+    for function, samples in _samples.items():
+        ordered = sorted(samples)
+        n = len(ordered)
+        stats[function] = {
+            "count": _calls.get(function, n),
+            "mean": round(sum(ordered) / n, 1),
+            "p50": ordered[n // 2],
+            "p95": ordered[min(n - 1, int(n * 0.95))],
+            "max": ordered[-1],
+        }
+    return stats
+
+
+def remaining(function, *static_parts, model="mistral"):
+    """Tokens left in the function's budget after its static prompt parts."""
+    used = sum(count_tokens(p, model) for p in static_parts)
+    return max(0, BUDGETS.get(function, 1000) - used)
+
+
+def trim_text(text, max_tokens, model="mistral"):
+    """Cut text so it fits max_tokens, keeping the beginning."""
+    if count_tokens(text, model) <= max_tokens:
+        return text
+    ratio = _chars_per_token.get(_model_key(model), FALLBACK_CHARS_PER_TOKEN)
+    return text[:max(0, int(max_tokens * ratio) - 3)].rstrip() + "..."
+
+
+def fit_lines(lines, max_tokens, model="mistral"):
+    """
+    Keep lines, in the given priority order, while they fit max_tokens.
+    Returns (kept_lines, dropped_count).
+    """
+    kept = []
+    used = 0
+    for line in lines:
+        cost = count_tokens(line, model) + 1
+        if used + cost > max_tokens:
+            break
+        kept.append(line)
+        used += cost
+    return kept, len(lines) - len(kept)
+
+
+def words(text):
+    return set(_WORD_RE.findall((text or "").lower()))
+
+
+def rank_by_relevance(query, items, key):
+    """Sort items by word overlap between query and key(item); stable for ties."""
+    query_words = words(query)
+    return sorted(items, key=lambda item: -len(query_words & words(key(item))))
@@ -0,0 +1,72 @@
+import asyncio
+
+from bot.llm import llm_available
+from bot.llm_ticket import llm_route, llm_route_batch
+
+BATCH_WINDOW = 0.03  # seconds to wait for other users' messages to route together
+MAX_BATCH = 8        # larger batches make the prompt (and every caller's wait) too long
+LOG_EVERY = 100      # routed messages between stats log lines
+
+
+class RouterBatcher:
+    """
+    Groups router calls that arrive within a short window into one LLM
+    request. A lone message, or any message the batched answer got wrong,
+    is routed on its own with llm_route. Valid batched answers are used
+    as-is, although the batched prompt is worded differently and lists only
+    each user's last few tickets, so a batched message can be routed
+    differently than it would have been on its own.
+    """
+
+    def __init__(self, window=BATCH_WINDOW, max_batch=MAX_BATCH):
+        self.window = window
+        self.max_batch = max_batch
+        self._pending = []
+        self._timer = None
+        self.stats = {"batches": 0, "batched_items": 0, "single": 0, "fallbacks": 0}
+        self._routed = 0
+
+    async def route(self, msg, session):
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((msg, session, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch):
+        results = [None] * len(batch)
+        if len(batch) > 1 and llm_available():
+            try:
+                results = await asyncio.to_thread(llm_route_batch, [(m, s) for m, s, _ in batch])
+                self.stats["batches"] += 1
+                self.stats["batched_items"] += sum(1 for r in results if r is not None)
+            except Exception as e:
+                print(f"Batched routing of {len(batch)} messages failed: {e}")
+
+        async def resolve(item, result):
+            msg, session, future = item
+            if result is None:
+                self.stats["single" if len(batch) == 1 else "fallbacks"] += 1
+                try:
+                    result = await asyncio.to_thread(llm_route, msg, session)
+                except Exception as e:
+                    if not future.done():
+                        future.set_exception(e)
+                    return
+            if not future.done():
+                future.set_result(result)
+
+        await asyncio.gather(*(resolve(item, result) for item, result in zip(batch, results)))
+        routed, self._routed = self._routed, self._routed + len(batch)
+        if routed // LOG_EVERY != self._routed // LOG_EVERY:
+            print(f"Router batching: {self.stats}")
@@ -3,28 +3,40 @@ import json
 import time
 
 SESSIONS_DIR = os.path.join(os.path.dirname(__file__), 'sessions')
-os.makedirs(SESSIONS_DIR, exist_ok=True)
 
 SESSION_TIMEOUT = 600  # 10 minutes in seconds
 
+_sessions_dir_ready = False
+
 def _session_path(user_id):
     return os.path.join(SESSIONS_DIR, f"{user_id}.json")
 
+def _writable_session_path(user_id):
+    # The sessions directory is created on first write instead of at import
+    global _sessions_dir_ready
+    if not _sessions_dir_ready:
+        os.makedirs(SESSIONS_DIR, exist_ok=True)
+        _sessions_dir_ready = True
+    return _session_path(user_id)
+
 def session_exists(user_id):
     return os.path.exists(_session_path(user_id))
 
-def create_session(user_id):
-    data = {
+def new_session(user_id, tickets=None):
+    """A fresh session dict (not yet written), carrying over tickets."""
+    return {
         "user_id": user_id,
-        "tickets": [],
+        "tickets": list(tickets or []),
         "history": [],
         "state": "awaiting_problem",
         "clarification_asked": False,
         "last_problem": "",
         "last_active": time.time()
     }
-    with open(_session_path(user_id), 'w', encoding='utf-8') as f:
-        json.dump(data, f)
+
+def create_session(user_id):
+    with open(_writable_session_path(user_id), 'w', encoding='utf-8') as f:
+        json.dump(new_session(user_id), f)
 
 def get_session(user_id):
     path = _session_path(user_id)
@@ -35,9 +47,16 @@ def get_session(user_id):
 
 def save_session(user_id, data):
     data['last_active'] = time.time()
-    with open(_session_path(user_id), 'w', encoding='utf-8') as f:
+    with open(_writable_session_path(user_id), 'w', encoding='utf-8') as f:
         json.dump(data, f)
 
+def reset_session(user_id, tickets=None):
+    """
+    Start a fresh session for user_id, carrying over tickets, in a single write.
+    """
+    with open(_writable_session_path(user_id), 'w', encoding='utf-8') as f:
+        json.dump(new_session(user_id, tickets), f)
+
 def clear_session(user_id):
     path = _session_path(user_id)
     if os.path.exists(path):
@@ -77,6 +96,10 @@ def log_history(user_id, from_role, text):
     session.setdefault("history", []).append({"from": from_role, "text": text})
     save_session(user_id, session)
 
+def is_expired(session):
+    """True if the session dict was last active more than SESSION_TIMEOUT seconds ago."""
+    return (time.time() - session.get("last_active", 0)) > SESSION_TIMEOUT
+
 def session_expired(user_id):
     """
     Returns True if the session exists but is older than SESSION_TIMEOUT seconds.
@@ -84,5 +107,4 @@ def session_expired(user_id):
     session = get_session(user_id)
     if not session:
         return True
-    last_active = session.get("last_active", 0)
-    return (time.time() - last_active) > SESSION_TIMEOUT
+    return is_expired(session)
@@ -0,0 +1,62 @@
+import asyncio
+import time
+
+
+class Startup:
+    """
+    Tracks the bot's warm-up: named steps run concurrently, each one timed, and
+    message handling waits on `wait()` until they have finished. A failing step
+    is logged and reported but does not block readiness; the dependency will
+    just be cold on first use.
+    """
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.timings = {}
+        self.errors = {}
+        self._done = asyncio.Event()
+        self._task = None
+
+    @property
+    def ready(self):
+        return self._done.is_set()
+
+    def mark(self, name, since=None):
+        """Record `name` as taking from `since` (default: process start) until now."""
+        self.timings[name] = time.perf_counter() - (since if since is not None else self.started_at)
+
+    async def _step(self, name, step):
+        mark = time.perf_counter()
+        try:
+            result = step()
+            if asyncio.iscoroutine(result):
+                await result
+        except Exception as e:
+            self.errors[name] = str(e)
+        self.mark(name, mark)
+
+    async def _run(self, steps):
+        await asyncio.gather(*(self._step(name, step) for name, step in steps.items()))
+        self.mark("ready")
+        self._done.set()
+        print(self.report())
+
+    def start(self, steps):
+        """
+        Run `steps` ({name: callable}) concurrently; callables may be sync
+        (wrap blocking work in asyncio.to_thread) or return a coroutine.
+        Only the first call has an effect.
+        """
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run(steps))
+        return self._task
+
+    async def wait(self):
+        await self._done.wait()
+
+    def report(self):
+        parts = ", ".join(f"{k}={v * 1000:.0f}ms" for k, v in self.timings.items())
+        text = f"Startup {'ready' if self.ready else 'in progress'}: {parts}"
+        if self.errors:
+            text += " | failed: " + ", ".join(f"{k} ({v})" for k, v in self.errors.items())
+        return text
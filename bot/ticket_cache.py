@@ -0,0 +1,94 @@
+import threading
+import time
+from collections import OrderedDict
+
+MAX_TICKETS = 256           # LRU bound on cached ticket snapshots
+MAX_NOTES_PER_TICKET = 50   # older notes are dropped from a snapshot
+PROBE_AFTER = 15            # seconds a snapshot is trusted without asking MantisHub
+PUSHED_PROBE_AFTER = 600    # the same when MantisHub pushes changes to us via webhooks
+
+
+class TicketCache:
+    """
+    LRU cache of MantisHub issue snapshots. Each entry keeps the issue fields
+    without notes, the notes merged by id, the conditional-request validators,
+    and the highest note id already shown to the user.
+    """
+
+    def __init__(self, max_tickets=MAX_TICKETS, probe_after=PROBE_AFTER):
+        self.max_tickets = max_tickets
+        self.probe_after = probe_after
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "not_modified": 0, "full_fetches": 0}
+
+    def get(self, ticket_id):
+        with self._lock:
+            entry = self._entries.get(int(ticket_id))
+            if entry:
+                self._entries.move_to_end(int(ticket_id))
+            return entry
+
+    def put(self, ticket_id, issue, validators=None):
+        """Store a freshly fetched issue, merging its notes into any cached ones."""
+        issue = dict(issue)
+        notes = issue.pop("notes", []) or []
+        with self._lock:
+            entry = self._entries.get(int(ticket_id)) or {"notes": OrderedDict(), "shown_upto": 0}
+            for note in notes:
+                entry["notes"][note.get("id")] = note
+            while len(entry["notes"]) > MAX_NOTES_PER_TICKET:
+                entry["notes"].popitem(last=False)
+            entry["issue"] = issue
+            entry["updated_at"] = issue.get("updated_at")
+            entry["validators"] = validators or {}
+            entry["checked_at"] = time.monotonic()
+            self._entries[int(ticket_id)] = entry
+            self._entries.move_to_end(int(ticket_id))
+            while len(self._entries) > self.max_tickets:
+                self._entries.popitem(last=False)
+            return entry
+
+    def touch(self, entry):
+        entry["checked_at"] = time.monotonic()
+
+    def forget(self, ticket_id):
+        with self._lock:
+            self._entries.pop(int(ticket_id), None)
+
+    def take_new_notes(self, entry):
+        """Notes the user hasn't been shown yet (all notes, oldest first); marks them shown."""
+        notes = [n for n in entry["notes"].values() if (n.get("id") or 0) > entry["shown_upto"]]
+        if notes:
+            entry["shown_upto"] = max(n.get("id") or 0 for n in notes)
+        return notes
+
+    def fetch(self, mh_client, ticket_id):
+        """
+        Current snapshot of a ticket, touching MantisHub as little as possible:
+        a recent snapshot is used as is; otherwise a conditional GET (when the
+        server gave validators) or an updated_at probe decides whether the
+        full issue with notes has to be downloaded again.
+        """
+        entry = self.get(ticket_id)
+        if entry and time.monotonic() - entry["checked_at"] < self.probe_after:
+            self.stats["hits"] += 1
+            return entry
+
+        validators = entry["validators"] if entry else {}
+        if entry and not (validators.get("etag") or validators.get("last_modified")):
+            if entry["updated_at"] and mh_client.get_ticket_updated_at(ticket_id) == entry["updated_at"]:
+                self.stats["not_modified"] += 1
+                self.touch(entry)
+                return entry
+            validators = {}
+
+        issue, new_validators = mh_client.get_ticket_if_changed(
+            ticket_id, validators.get("etag"), validators.get("last_modified")
+        )
+        if issue is None:
+            self.stats["not_modified"] += 1
+            self.touch(entry)
+            return entry
+        self.stats["full_fetches"] += 1
+        return self.put(ticket_id, issue, new_validators)
@@ -0,0 +1,132 @@
+import difflib
+import re
+
+from bot.llm_ticket import llm_pick_ticket_id
+
+# Words that say what to do with a ticket rather than which ticket it is
+COMMAND_WORDS = {
+    "close", "closed", "delete", "remove", "cancel", "resolve", "resolved", "mark", "finish", "done",
+    "ticket", "tickets", "issue", "case", "support", "request", "my", "the", "a", "an", "this", "that",
+    "please", "pls", "for", "about", "with", "one", "is", "it", "solved", "last", "id", "number",
+}
+# Filler, contraction fragments ("won't" -> "won", "t") and timing words, which
+# say nothing about which problem a ticket is about
+FILLER_WORDS = {
+    "won", "t", "s", "don", "doesn", "didn", "isn", "can", "cannot", "not", "no", "will", "would", "still",
+    "just", "now", "again", "and", "or", "but", "of", "to", "in", "on", "at", "from", "i", "me", "we", "you",
+    "was", "be", "been", "has", "have", "had", "which", "what", "all", "any", "other", "ago", "day", "days",
+    "week", "weeks", "yesterday", "today", "earlier", "old", "new", "first", "opened", "created", "raised",
+}
+FUZZY_CUTOFF = 0.8
+LOG_EVERY = 50  # resolutions between stats log lines
+
+RESOLVER_STATS = {
+    "explicit_id": 0,
+    "single_ticket": 0,
+    "keyword": 0,
+    "llm": 0,
+}
+
+_NUMBER_RE = re.compile(r"\b\d+\b")
+_ID_RE = re.compile(r"(?:\b(?:ticket|id|number)|#)\s*#?\s*(\d+)\b")  # "ticket 15", "#15", "id 15"
+_WORD_RE = re.compile(r"[a-z]+")
+
+
+def _ticket_words(ticket):
+    text = f"{ticket.get('summary', '')} {ticket.get('category', '')}".lower()
+    return set(_WORD_RE.findall(text)) - COMMAND_WORDS - FILLER_WORDS
+
+
+def _keyword_score(query_words, ticket_words):
+    score = 0.0
+    for word in query_words:
+        if word in ticket_words:
+            score += 1
+        elif len(word) >= 4 and any(tw.startswith(word) or word.startswith(tw) for tw in ticket_words if len(tw) >= 4):
+            score += 0.75  # "leak" for "leaking"
+        elif difflib.get_close_matches(word, ticket_words, n=1, cutoff=FUZZY_CUTOFF):
+            score += 0.5  # typos such as "leek" for "leak"
+    return score
+
+
+def _query_words(command):
+    return set(_WORD_RE.findall(command.lower())) - COMMAND_WORDS - FILLER_WORDS
+
+
+def _keyword_match(command, tickets):
+    query_words = _query_words(command)
+    if not query_words:
+        return None
+    scored = sorted(
+        ((_keyword_score(query_words, _ticket_words(t)), t) for t in tickets),
+        key=lambda pair: pair[0], reverse=True
+    )
+    if not scored or scored[0][0] == 0:
+        return None
+    if len(scored) > 1 and scored[1][0] == scored[0][0]:
+        return None  # tie: genuinely ambiguous
+    return scored[0][1]
+
+
+def match_ticket(command, tickets, skip_status=None):
+    """
+    Work out which of the user's tickets `command` refers to without the LLM.
+
+    A number is an ID when the command marks it as one ("ticket 15", "#15") or
+    says nothing else ("close 15"); other numbers ("from 2 days ago") are left
+    to the words around them. An ID that is not one of the user's tickets is
+    never guessed at. Otherwise: the user's only candidate ticket when the
+    command names nothing that contradicts it, then a unique keyword match on
+    cached summaries and categories. Tickets whose status is in `skip_status`
+    (e.g. already closed) are not candidates unless named by ID.
+    Returns (ticket_id, []) when that settles it, ticket_id being None if it
+    can't be resolved, or (None, candidates) when only pick_ticket() can tell.
+    """
+    tickets = [t for t in tickets if isinstance(t, dict)]
+    by_id = {int(t["id"]): t for t in tickets}
+    query_words = _query_words(command)
+
+    ids = {int(n) for n in _ID_RE.findall(command.lower())}
+    if not query_words:
+        ids |= {int(n) for n in _NUMBER_RE.findall(command)}
+    if ids:
+        if len(ids) > 1 or not ids <= by_id.keys():
+            return None, []  # several IDs, or an ID that isn't theirs
+        tid = ids.pop()
+        if query_words and _keyword_score(query_words, _ticket_words(by_id[tid])) == 0 and _keyword_match(command, tickets):
+            return None, tickets  # "close ticket 2, the noise one" when 2 is the leak: let the picker weigh it
+        _count("explicit_id")
+        return tid, []
+
+    skip = {s.lower() for s in (skip_status or ())}
+    candidates = [t for t in tickets if str(t.get("status", "")).lower() not in skip]
+    if not candidates:
+        return None, []
+    if len(candidates) == 1:
+        # "close my ticket" or "close the leak ticket" for a leak ticket, but not "delete my noise ticket"
+        if not query_words or _keyword_score(query_words, _ticket_words(candidates[0])) > 0:
+            _count("single_ticket")
+            return int(candidates[0]["id"]), []
+    else:
+        match = _keyword_match(command, candidates)
+        if match:
+            _count("keyword")
+            return int(match["id"]), []
+    return None, candidates
+
+
+def pick_ticket(command, candidates):
+    """Ask the LLM which of `candidates` the command means. Returns one of their IDs, or None."""
+    _count("llm")
+    tid = llm_pick_ticket_id(command, candidates)
+    return tid if tid in {int(t["id"]) for t in candidates} else None
+
+
+def llm_calls_avoided():
+    return RESOLVER_STATS["explicit_id"] + RESOLVER_STATS["single_ticket"] + RESOLVER_STATS["keyword"]
+
+
+def _count(outcome):
+    RESOLVER_STATS[outcome] += 1
+    if sum(RESOLVER_STATS.values()) % LOG_EVERY == 0:
+        print(f"Ticket resolver: {RESOLVER_STATS}, LLM calls avoided: {llm_calls_avoided()}")
@@ -0,0 +1,278 @@
+import asyncio
+import time
+
+from bot.duplicates import find_duplicate, index_ticket
+from bot.llm_ticket import llm_parse_ticket_fields
+from bot.pending_ops import enqueue_op
+from bot.user_tickets import add_ticket_for_user, get_tickets_for_user
+from mantishub.exceptions import MantisHubAPIError, MantisHubUnavailable
+
+CATALOG_TTL = 300  # seconds before the project/category catalog is refreshed
+
+QUEUED_MESSAGE = (
+    "⏳ Our ticket system is unavailable right now. Your request has been queued "
+    "and I'll message you here as soon as it has gone through."
+)
+
+
+class CatalogIndex:
+    """
+    Snapshot of MantisHub projects and categories with lowercase-name indexes,
+    so matching LLM output to ids is a dict lookup instead of a list scan.
+    """
+
+    def __init__(self, projects, categories_by_project):
+        self.projects = projects
+        self.categories_by_project = categories_by_project
+        self.fetched_at = time.time()
+        self.project_by_name = {p['name'].lower(): p for p in projects}
+        self.category_by_name = {
+            pid: {c['name'].lower(): c for c in cats}
+            for pid, cats in categories_by_project.items()
+        }
+
+    def is_stale(self, ttl=CATALOG_TTL):
+        return (time.time() - self.fetched_at) > ttl
+
+    def match(self, project_name, category_name):
+        """Return (project, category) for the given names, or (None, None)."""
+        project = self.project_by_name.get((project_name or "").lower())
+        if not project:
+            return None, None
+        categories = self.category_by_name.get(str(project['id']), {})
+        category = categories.get((category_name or "").lower())
+        if not category:
+            return None, None
+        return project, category
+
+    def fallback(self):
+        """First project with its first category, used when the LLM parse fails."""
+        if not self.projects:
+            return None, None
+        project = self.projects[0]
+        categories = self.categories_by_project.get(str(project['id']), [])
+        return project, (categories[0] if categories else None)
+
+
+class TicketCreationService:
+    """
+    Owns the escalation flow: catalog fetch, LLM field parsing, project/category
+    matching, ticket creation in MantisHub and persisting ticket ownership.
+    Resetting the conversation afterwards is left to the dialog, which writes
+    the session once per message.
+
+    The catalog is cached; when a cached copy exists the LLM parse runs against
+    it while a refresh (if stale) happens concurrently. Every call records how
+    long each stage took in result["timings"]. While MantisHub is unavailable
+    the request is queued in bot.pending_ops and completed by replay_create.
+    """
+
+    def __init__(self, mh_client, catalog_ttl=CATALOG_TTL):
+        self.mh_client = mh_client
+        self.catalog_ttl = catalog_ttl
+        self._catalog = None
+        self._refresh_task = None
+
+    def _fetch_catalog(self):
+        projects = self.mh_client.list_projects()
+        categories_by_project = {str(p['id']): self.mh_client.list_categories(p['id']) for p in projects}
+        return CatalogIndex(projects, categories_by_project)
+
+    async def refresh_catalog(self):
+        """Fetch the catalog, sharing one in-flight request between callers."""
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.ensure_future(asyncio.to_thread(self._fetch_catalog))
+        self._catalog = await self._refresh_task
+        return self._catalog
+
+    async def prefetch_catalog(self):
+        """Refresh the catalog in advance if it is missing or stale; errors are only logged."""
+        if self._catalog is None or self._catalog.is_stale(self.catalog_ttl):
+            try:
+                await self.refresh_catalog()
+            except Exception as e:
+                print(f"Catalog prefetch failed: {e}")
+
+    async def _refresh_or_stale(self):
+        # A stale catalog is still good enough to file a ticket against
+        try:
+            return await self.refresh_catalog()
+        except MantisHubAPIError:
+            return self._catalog
+
+    async def _parse(self, problem, catalog):
+        return await asyncio.to_thread(
+            llm_parse_ticket_fields, problem, catalog.projects, catalog.categories_by_project
+        )
+
+    async def _prepare(self, discord_username, problem, timings):
+        """
+        Pick project/category and summary for the problem.
+        Returns the ticket fields, or {"error": <user-facing text>}.
+        """
+        started = time.perf_counter()
+        catalog = self._catalog
+        if catalog is None:
+            catalog = await self.refresh_catalog()
+            timings["catalog"] = time.perf_counter() - started
+            mark = time.perf_counter()
+            parsed = await self._parse(problem, catalog) if catalog.projects else None
+            timings["parse"] = time.perf_counter() - mark
+        elif catalog.is_stale(self.catalog_ttl):
+            async def timed(name, coro):
+                mark = time.perf_counter()
+                result = await coro
+                timings[name] = time.perf_counter() - mark
+                return result
+            catalog, parsed = await asyncio.gather(
+                timed("catalog", self._refresh_or_stale()),
+                timed("parse", self._parse(problem, catalog)),
+            )
+        else:
+            timings["catalog"] = 0.0
+            mark = time.perf_counter()
+            parsed = await self._parse(problem, catalog)
+            timings["parse"] = time.perf_counter() - mark
+
+        if not catalog.projects:
+            return {"error": "⚠️ No projects found in MantisHub. Contact admin."}
+
+        mark = time.perf_counter()
+        if parsed:
+            project, category = catalog.match(parsed.get('project_name'), parsed.get('category_name'))
+            timings["match"] = time.perf_counter() - mark
+            if not (project and category):
+                return {"error": "Sorry, I couldn't match your issue to an exact project/category. Please try rephrasing or contact support."}
+            summary_text = parsed['summary']
+            description = parsed['description']
+            created_message = "🎫 Ticket created! Your ticket ID is `{}`. You can check status by typing `status`."
+        else:
+            project, category = catalog.fallback()
+            timings["match"] = time.perf_counter() - mark
+            if not category:
+                return {"error": "Sorry, I couldn't create a ticket because there is no available category. Please contact support."}
+            summary_text = problem[:50]
+            description = problem
+            created_message = "🎫 Ticket created (default category)! Your ticket ID is `{}`. You can check status by typing `status`."
+
+        return {
+            "summary": f"{discord_username}: {summary_text}",
+            "summary_text": summary_text,
+            "description": description,
+            "project_id": project['id'],
+            "category": category['name'],
+            "message": created_message,
+        }
+
+    async def _create(self, fields, timings):
+        mark = time.perf_counter()
+        ticket = await asyncio.to_thread(
+            self.mh_client.create_ticket,
+            summary=fields["summary"],
+            description=fields["description"],
+            project_id=fields["project_id"],
+            category=fields["category"]
+        )
+        timings["create"] = time.perf_counter() - mark
+        return ticket.get("issue", {}).get("id") or ticket.get("id")
+
+    async def create_ticket(self, user_id, discord_username, problem, check_duplicates=True):
+        """
+        Create a ticket for `problem` on behalf of user_id.
+        Returns a dict with "ok", "ticket_id", "message" (user-facing text) and "timings".
+        If one of the user's own recent tickets is a near-duplicate, nothing is
+        created and the result carries "duplicate_of" with that ticket id
+        instead. A match on another user's ticket never merges the two: the
+        user gets their own ticket, whose description names the related one
+        for the support team.
+        If MantisHub is unavailable the request is queued and "queued" is set;
+        any other failure returns "ok" False with an error message.
+        """
+        timings = {}
+        started = time.perf_counter()
+
+        related = None
+        if check_duplicates:
+            duplicate = find_duplicate(user_id, problem)
+            timings["dedup"] = time.perf_counter() - started
+            if duplicate and duplicate["own"]:
+                tid = duplicate["ticket_id"]
+                result = self._result(
+                    False, None,
+                    f"🔁 This looks like your existing ticket `{tid}`. "
+                    "Should I add your message to it as an update instead of opening a new ticket? (yes/no)",
+                    timings, started
+                )
+                result["duplicate_of"] = tid
+                return result
+            if duplicate:
+                related = duplicate["ticket_id"]
+
+        fields = None
+        try:
+            fields = await self._prepare(discord_username, problem, timings)
+            if "error" in fields:
+                return self._result(False, None, fields["error"], timings, started)
+            if related:
+                fields["description"] += f"\n\nPossibly the same fault as issue #{related}, reported by another customer."
+            ticket_id = await self._create(fields, timings)
+        except MantisHubUnavailable:
+            enqueue_op("create", user_id, username=discord_username, problem=problem, fields=fields)
+            result = self._result(False, None, QUEUED_MESSAGE, timings, started)
+            result["queued"] = True
+            return result
+        except Exception as e:
+            # No catalog to fall back on, or MantisHub rejected the ticket (4xx/5xx)
+            print(f"Ticket creation failed for user {user_id}: {e}")
+            return self._result(
+                False, None, "⚠️ Sorry, I couldn't create your ticket right now. Please try again later or contact support.",
+                timings, started
+            )
+
+        mark = time.perf_counter()
+        await asyncio.to_thread(self._record_ticket, user_id, ticket_id, fields["category"], problem, fields["summary_text"])
+        timings["persist"] = time.perf_counter() - mark
+
+        return self._result(True, ticket_id, fields["message"].format(ticket_id), timings, started)
+
+    async def replay_create(self, op):
+        """Complete a create queued by create_ticket; returns the text to send the user."""
+        timings = {}
+        fields = op.get("fields") or await self._prepare(op["username"], op["problem"], timings)
+        if "error" in fields:
+            return fields["error"]
+        ticket_id = await self._create(fields, timings)
+        await asyncio.to_thread(
+            self._record_ticket, op["user_id"], ticket_id, fields["category"], op["problem"], fields["summary_text"]
+        )
+        return fields["message"].format(ticket_id)
+
+    async def attach_to_ticket(self, user_id, ticket_id, problem):
+        """
+        Add `problem` as a note on one of the user's own tickets instead of
+        opening a new one. Tickets raised by other users are never touched.
+        """
+        timings = {}
+        started = time.perf_counter()
+        if not any(int(t.get("id")) == int(ticket_id) for t in get_tickets_for_user(user_id)):
+            return self._result(
+                False, None, "⚠️ That ticket isn't one of yours. Please describe your problem again to open a new ticket.",
+                timings, started
+            )
+        message = f"📝 Added your message to ticket `{ticket_id}`. You can check status by typing `status`."
+        try:
+            await asyncio.to_thread(self.mh_client.add_note_to_ticket, ticket_id, problem)
+        except MantisHubUnavailable:
+            enqueue_op("note", user_id, ticket_id=ticket_id, text=problem)
+            message = QUEUED_MESSAGE
+        timings["note"] = time.perf_counter() - started
+        return self._result(True, ticket_id, message, timings, started)
+
+    def _record_ticket(self, user_id, ticket_id, category_name, problem, summary):
+        add_ticket_for_user(user_id, ticket_id, category=category_name, status="open", summary=summary)
+        index_ticket(user_id, ticket_id, problem)
+
+    def _result(self, ok, ticket_id, message, timings, started):
+        timings["total"] = time.perf_counter() - started
+        print("ticket_creation timings: " + ", ".join(f"{k}={v * 1000:.0f}ms" for k, v in timings.items()))
+        return {"ok": ok, "ticket_id": ticket_id, "message": message, "timings": timings}
@@ -1,8 +1,25 @@
+import functools
 import os
 import json
+import threading
+import time
 
 TICKETS_DB_PATH = os.path.join(os.path.dirname(__file__), "user_tickets.json")
 
+# Reverse index ticket_id -> user_id, rebuilt whenever the db file changes
+_owners = {}
+_owners_mtime = None
+# The event loop, webhook events and ticket creation all read-modify-write the
+# db, the latter two from worker threads; every public function holds this
+_db_lock = threading.Lock()
+
+def _locked(fn):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with _db_lock:
+            return fn(*args, **kwargs)
+    return wrapper
+
 def _load_db():
     if not os.path.exists(TICKETS_DB_PATH):
         return {}
@@ -10,8 +27,27 @@ def _load_db():
         return json.load(f)
 
 def _save_db(data):
-    with open(TICKETS_DB_PATH, "w", encoding="utf-8") as f:
+    global _owners, _owners_mtime
+    tmp_path = TICKETS_DB_PATH + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
         json.dump(data, f)
+    os.replace(tmp_path, TICKETS_DB_PATH)  # readers never see a half-written file
+    # We just wrote the file, so the index can be derived from what we wrote
+    _owners = _build_owners(data)
+    _owners_mtime = os.path.getmtime(TICKETS_DB_PATH)
+
+def _build_owners(data):
+    return {int(t.get("id")): user_id for user_id, tickets in data.items() for t in tickets}
+
+@_locked
+def owner_of(ticket_id):
+    """The user_id owning a ticket, or None. O(1) unless the db file changed on disk."""
+    global _owners, _owners_mtime
+    mtime = os.path.getmtime(TICKETS_DB_PATH) if os.path.exists(TICKETS_DB_PATH) else None
+    if mtime != _owners_mtime:
+        _owners = _build_owners(_load_db())
+        _owners_mtime = mtime
+    return _owners.get(int(ticket_id))
 
 def _find_ticket(tickets, ticket_id):
     for t in tickets:
@@ -19,7 +55,8 @@ def _find_ticket(tickets, ticket_id):
             return t
     return None
 
-def add_ticket_for_user(user_id, ticket_id, category="General", status="open"):
+@_locked
+def add_ticket_for_user(user_id, ticket_id, category="General", status="open", summary=None):
     data = _load_db()
     user_id = str(user_id)
     ticket_id = int(ticket_id)
@@ -30,11 +67,17 @@ def add_ticket_for_user(user_id, ticket_id, category="General", status="open"):
         # Update if category or status has changed
         found["category"] = category
         found["status"] = status
+        if summary:
+            found["summary"] = summary
     else:
-        tickets.append({"id": ticket_id, "category": category, "status": status})
+        tickets.append({
+            "id": ticket_id, "category": category, "status": status,
+            "summary": summary or "", "created_at": time.strftime("%Y-%m-%d %H:%M")
+        })
     data[user_id] = tickets
     _save_db(data)
 
+@_locked
 def remove_ticket_for_user(user_id, ticket_id):
     data = _load_db()
     user_id = str(user_id)
@@ -44,10 +87,12 @@ def remove_ticket_for_user(user_id, ticket_id):
     data[user_id] = new_tickets
     _save_db(data)
 
+@_locked
 def get_tickets_for_user(user_id):
     data = _load_db()
     return data.get(str(user_id), [])
 
+@_locked
 def update_ticket_status_for_user(user_id, ticket_id, status):
     data = _load_db()
     user_id = str(user_id)
@@ -59,6 +104,7 @@ def update_ticket_status_for_user(user_id, ticket_id, status):
     data[user_id] = tickets
     _save_db(data)
 
+@_locked
 def update_ticket_category_for_user(user_id, ticket_id, category):
     data = _load_db()
     user_id = str(user_id)
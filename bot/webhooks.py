@@ -0,0 +1,111 @@
+import asyncio
+import hmac
+import os
+
+from aiohttp import web
+
+from bot.duplicates import forget_ticket, ticket_status_changed
+from bot.outbound import format_ticket_history
+from bot.user_tickets import (
+    get_tickets_for_user, owner_of, remove_ticket_for_user,
+    update_ticket_category_for_user, update_ticket_status_for_user
+)
+
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "127.0.0.1")
+WEBHOOK_PORT = os.getenv("WEBHOOK_PORT")  # receiver is off unless a port is configured
+WEBHOOK_PATH = "/mantishub"
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")  # required; sent by MantisHub in the X-Webhook-Token header
+
+DELETE_EVENTS = {"issue_deleted", "bug_deleted"}
+
+
+class WebhookReceiver:
+    """
+    Small HTTP endpoint for MantisHub issue events. Each event refreshes the
+    cached ticket snapshot and the owner's ticket record, then tells the owner
+    what changed, so nothing has to poll MantisHub for updates.
+    """
+
+    def __init__(self, ticket_cache, notify, secret=WEBHOOK_SECRET):
+        self.ticket_cache = ticket_cache
+        self.notify = notify
+        self.secret = secret
+        self._runner = None
+        self.stats = {"received": 0, "notified": 0, "ignored": 0, "rejected": 0}
+
+    def apply(self, payload):
+        """Update local state for one event. Returns (user_id, text) to notify, or None."""
+        issue = payload.get("issue") if isinstance(payload.get("issue"), dict) else {}
+        tid = issue.get("id") or payload.get("issue_id")
+        if not tid:
+            raise ValueError("event has no issue id")
+        user_id = owner_of(tid)
+        if user_id is None:
+            # Not a ticket the bot created
+            return None
+
+        if payload.get("event") in DELETE_EVENTS:
+            self.ticket_cache.forget(tid)
+            remove_ticket_for_user(user_id, tid)
+            forget_ticket(tid)
+            return user_id, f"🗑️ Your ticket `{tid}` was deleted by support."
+
+        if not issue.get("summary"):
+            # Event carries no issue body: drop the snapshot so the next status check refetches
+            self.ticket_cache.forget(tid)
+            return user_id, f"🔔 Your ticket `{tid}` was updated. Type `status` to see the latest."
+
+        entry = self.ticket_cache.put(tid, issue)
+        record = next((t for t in get_tickets_for_user(user_id) if int(t.get("id")) == int(tid)), {})
+        status = issue.get("status", {}).get("name") or record.get("status", "")
+        category = issue.get("category", {}).get("name") or record.get("category", "")
+        status_changed = status != record.get("status")
+        if status_changed:
+            update_ticket_status_for_user(user_id, tid, status)
+            ticket_status_changed(tid, status)
+        if category != record.get("category"):
+            update_ticket_category_for_user(user_id, tid, category)
+
+        new_notes = self.ticket_cache.take_new_notes(entry)
+        if not new_notes and not status_changed:
+            return None
+        return user_id, "🔔 Update on your ticket:" + format_ticket_history(
+            tid, issue["summary"], status, category, new_notes, total_notes=len(entry["notes"])
+        )
+
+    async def handle(self, request):
+        # Header only: query strings end up in access logs
+        token = request.headers.get("X-Webhook-Token", "")
+        if not self.secret or not hmac.compare_digest(token.encode("utf-8"), self.secret.encode("utf-8")):
+            self.stats["rejected"] += 1
+            return web.Response(status=401)
+        try:
+            payload = await request.json()
+            outcome = await asyncio.to_thread(self.apply, payload)
+        except Exception as e:
+            print(f"Bad MantisHub webhook payload: {e}")
+            self.stats["rejected"] += 1
+            return web.Response(status=400)
+        self.stats["received"] += 1
+        if outcome is None:
+            self.stats["ignored"] += 1
+        else:
+            self.stats["notified"] += 1
+            # Answer MantisHub right away; Discord delivery can take a while
+            asyncio.ensure_future(self.notify(*outcome))
+        return web.Response(text="ok")
+
+    async def start(self, host=WEBHOOK_HOST, port=WEBHOOK_PORT):
+        if not self.secret:
+            # Without it anyone who can reach the port could delete tickets and message users
+            raise RuntimeError("WEBHOOK_SECRET must be set to receive MantisHub webhooks")
+        app = web.Application()
+        app.router.add_post(WEBHOOK_PATH, self.handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, int(port)).start()
+        print(f"Listening for MantisHub webhooks on http://{host}:{port}{WEBHOOK_PATH}")
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
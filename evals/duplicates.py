@@ -0,0 +1,43 @@
+"""
+Checks duplicate detection against labeled problem pairs in
+evals/datasets/duplicates.jsonl, once as the same user and once across users:
+
+    python -m evals.duplicates
+
+Exits non-zero if any pair is misjudged, so threshold or shingling changes
+can be checked before they ship.
+"""
+import json
+import os
+import sys
+
+from bot.duplicates import DuplicateIndex
+
+PAIRS_PATH = os.path.join(os.path.dirname(__file__), "datasets", "duplicates.jsonl")
+
+
+def check(pairs):
+    failures = 0
+    for pair in pairs:
+        for scope, owner in (("own", "u1"), ("cross", "u2")):
+            index = DuplicateIndex()
+            index.add(1, owner, pair["a"])
+            match = index.find("u1", pair["b"])
+            found = match is not None
+            ok = found == pair["duplicate"]
+            failures += not ok
+            score = f"{match['score']:.2f}" if match else "-"
+            print(f"{'ok  ' if ok else 'FAIL'} {scope:<5} expected={pair['duplicate']!s:<5} score={score:<4} {pair['a']!r} / {pair['b']!r}")
+    return failures
+
+
+def main():
+    with open(PAIRS_PATH, "r", encoding="utf-8") as f:
+        pairs = [json.loads(line) for line in f if line.strip()]
+    failures = check(pairs)
+    print(f"\n{len(pairs) * 2 - failures}/{len(pairs) * 2} checks passed")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
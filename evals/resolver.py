@@ -0,0 +1,41 @@
+"""
+Checks the local ticket resolver (bot.ticket_resolver.match_ticket) against
+the labeled commands in evals/datasets/resolve.jsonl:
+
+    python -m evals.resolver
+
+"expected" is the ticket ID, null when the command must not resolve, or
+"llm" when only the picker may decide. No model is called. Exits non-zero
+if any command is misjudged, so resolver changes can be checked before they
+ship.
+"""
+import json
+import os
+import sys
+
+from bot.ticket_resolver import match_ticket
+
+CASES_PATH = os.path.join(os.path.dirname(__file__), "datasets", "resolve.jsonl")
+
+
+def check(cases):
+    failures = 0
+    for case in cases:
+        tid, candidates = match_ticket(case["command"], case["tickets"], case.get("skip_status"))
+        got = "llm" if candidates else tid
+        ok = got == case["expected"]
+        failures += not ok
+        print(f"{'ok  ' if ok else 'FAIL'} expected={case['expected']!s:<5} got={got!s:<5} {case['command']!r}")
+    return failures
+
+
+def main():
+    with open(CASES_PATH, "r", encoding="utf-8") as f:
+        cases = [json.loads(line) for line in f if line.strip()]
+    failures = check(cases)
+    print(f"\n{len(cases) - failures}/{len(cases)} checks passed")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
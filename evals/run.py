@@ -0,0 +1,240 @@
+"""
+Offline evaluation of the bot's LLM calls: routing, ticket field parsing and
+ticket picking, scored against the labeled cases in evals/datasets.
+
+    python -m evals.run --models mistral,llama3.1:8b
+    python -m evals.run --models mistral --mode record   # also save responses
+    python -m evals.run --models mistral --mode replay   # no Ollama needed
+
+Each case goes through the same public function the bot uses, so prompt
+building and trimming are part of what is measured. Replay mode answers from
+evals/recordings/<model>.jsonl and reports the latencies recorded with them.
+"""
+import argparse
+import hashlib
+import json
+import os
+import statistics
+import time
+
+from bot import llm, llm_tasks
+from bot.circuit import CircuitBreaker
+from bot.llm_ticket import ROUTE_ACTIONS, llm_parse_ticket_fields, llm_pick_ticket_id, llm_route
+
+EVALS_DIR = os.path.dirname(__file__)
+DATASETS_DIR = os.path.join(EVALS_DIR, "datasets")
+RECORDINGS_DIR = os.path.join(EVALS_DIR, "recordings")
+TASKS = ("route", "parse_fields", "pick_ticket")
+
+
+def load_cases(task):
+    with open(os.path.join(DATASETS_DIR, f"{task}.jsonl"), "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def load_catalog():
+    with open(os.path.join(DATASETS_DIR, "catalog.json"), "r", encoding="utf-8") as f:
+        catalog = json.load(f)
+    return catalog["projects"], catalog["categories_by_project"]
+
+
+def _recording_path(model):
+    return os.path.join(RECORDINGS_DIR, model.replace(":", "_").replace("/", "_") + ".jsonl")
+
+
+def _request_key(model, messages, options):
+    raw = json.dumps([model, messages, options or {}], sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class EvalTransport:
+    """
+    Stands in for the Ollama chat call (see bot.llm.set_transport). Forces the
+    model under evaluation and keeps what each call returned, so the harness
+    can score raw outputs that the bot's functions would otherwise swallow.
+    mode is "live", "record" or "replay".
+    """
+
+    def __init__(self, model, mode="live"):
+        self.model = model
+        self.mode = mode
+        self.calls = []
+        self._recorded = {}
+        if mode == "replay":
+            if not os.path.exists(_recording_path(model)):
+                raise SystemExit(f"No recordings for {model}; run with --mode record first")
+            with open(_recording_path(model), "r", encoding="utf-8") as f:
+                for line in f:
+                    entry = json.loads(line)
+                    self._recorded[entry["key"]] = entry
+
+    def __call__(self, model, messages, keep_alive=None, options=None, **kwargs):
+        key = _request_key(self.model, messages, options)
+        call = {"content": None, "tokens_in": None, "tokens_out": None, "latency": None, "error": None}
+        self.calls.append(call)
+        try:
+            if self.mode == "replay":
+                entry = self._recorded.get(key)
+                if entry is None:
+                    raise KeyError("no recorded response for this prompt")
+                response = {
+                    "message": {"content": entry["content"]},
+                    "prompt_eval_count": entry["tokens_in"], "eval_count": entry["tokens_out"],
+                }
+                call["latency"] = entry["latency"]
+            else:
+                started = time.perf_counter()
+                response = llm._client().chat(
+                    model=self.model, messages=messages, keep_alive=keep_alive, options=options, **kwargs
+                )
+                call["latency"] = time.perf_counter() - started
+        except Exception as e:
+            call["error"] = str(e)
+            raise
+        call["content"] = response["message"]["content"]
+        call["tokens_in"] = response.get("prompt_eval_count")
+        call["tokens_out"] = response.get("eval_count")
+        if self.mode == "record":
+            os.makedirs(RECORDINGS_DIR, exist_ok=True)
+            with open(_recording_path(self.model), "a", encoding="utf-8") as f:
+                f.write(json.dumps({"key": key, **{k: v for k, v in call.items() if k != "error"}}) + "\n")
+        return response
+
+
+def _strip_fences(text):
+    return text.replace("```json", "").replace("```", "").strip()
+
+
+def _json_object(text):
+    try:
+        parsed = json.loads(_strip_fences(text))
+    except (TypeError, ValueError):
+        return None
+    return parsed if isinstance(parsed, dict) else None
+
+
+def run_route(case, catalog):
+    result = llm_route(case["message"], case.get("session", {}))
+    return lambda raw: (_json_object(raw) or {}).get("action") in ROUTE_ACTIONS, result.get("action") == case["expected"]
+
+
+def run_parse_fields(case, catalog):
+    projects, categories_by_project = catalog
+    result = llm_parse_ticket_fields(case["problem"], projects, categories_by_project)
+    expected = case["expected"]
+    correct = bool(result) and all(
+        str(result.get(field, "")).strip().lower() == expected[field].lower()
+        for field in ("project_name", "category_name")
+    )
+    fields = ("summary", "description", "project_name", "category_name")
+    return lambda raw: all(f in (_json_object(raw) or {}) for f in fields), correct
+
+
+def run_pick_ticket(case, catalog):
+    result = llm_pick_ticket_id(case["command"], case["tickets"])
+    valid = lambda raw: raw.strip().strip('"').isdigit() or raw.strip().strip('"').lower() == "null"
+    return valid, result == case["expected"]
+
+
+RUNNERS = {"route": run_route, "parse_fields": run_parse_fields, "pick_ticket": run_pick_ticket}
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def evaluate(model, task, cases, catalog, transport):
+    correct = valid = errors = 0
+    tokens_in, tokens_out, latencies = [], [], []
+    for case in cases:
+        transport.calls.clear()
+        llm_tasks.clear_cache()  # every case must reach the model
+        is_valid, is_correct = RUNNERS[task](case, catalog)
+        call = transport.calls[-1] if transport.calls else None
+        if call is None or call["error"]:
+            errors += 1
+            continue
+        correct += is_correct
+        valid += is_valid(call["content"])
+        if call["tokens_in"] is not None:
+            tokens_in.append(call["tokens_in"])
+        if call["tokens_out"] is not None:
+            tokens_out.append(call["tokens_out"])
+        latencies.append(call["latency"])
+
+    n = len(cases)
+    return {
+        "model": model, "task": task, "cases": n, "errors": errors,
+        "accuracy": correct / n if n else 0.0,
+        "json_valid": valid / n if n else 0.0,
+        "tokens_in": statistics.mean(tokens_in) if tokens_in else None,
+        "tokens_out": statistics.mean(tokens_out) if tokens_out else None,
+        "p50_ms": _percentile(latencies, 50) * 1000 if latencies else None,
+        "p90_ms": _percentile(latencies, 90) * 1000 if latencies else None,
+        "p99_ms": _percentile(latencies, 99) * 1000 if latencies else None,
+    }
+
+
+def _fmt(value, width=7):
+    return f"{'-':>{width}}" if value is None else f"{value:>{width}.0f}"
+
+
+def print_report(rows):
+    header = f"{'model':<24} {'task':<13} {'n':>4} {'err':>4} {'acc':>6} {'json':>6} {'tok_in':>7} {'tok_out':>7} {'p50ms':>7} {'p90ms':>7} {'p99ms':>7}"
+    print(header)
+    print("-" * len(header))
+    for r in rows:
+        print(
+            f"{r['model']:<24} {r['task']:<13} {r['cases']:>4} {r['errors']:>4} "
+            f"{r['accuracy']:>6.1%} {r['json_valid']:>6.1%} {_fmt(r['tokens_in'])} {_fmt(r['tokens_out'])} "
+            f"{_fmt(r['p50_ms'])} {_fmt(r['p90_ms'])} {_fmt(r['p99_ms'])}"
+        )
+
+
+def fastest_passing(rows, min_accuracy):
+    """The model with the lowest summed p50 latency whose accuracy meets the bar on every task."""
+    by_model = {}
+    for r in rows:
+        by_model.setdefault(r["model"], []).append(r)
+    passing = [
+        (sum(r["p50_ms"] or 0 for r in model_rows), model)
+        for model, model_rows in by_model.items()
+        if all(r["accuracy"] >= min_accuracy and not r["errors"] for r in model_rows)
+    ]
+    return min(passing)[1] if passing else None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Evaluate LLM routing, parsing and ticket picking.")
+    parser.add_argument("--models", default=llm.MODEL, help="comma-separated Ollama models")
+    parser.add_argument("--tasks", default=",".join(TASKS), help="comma-separated subset of " + ", ".join(TASKS))
+    parser.add_argument("--mode", choices=("live", "record", "replay"), default="live")
+    parser.add_argument("--min-accuracy", type=float, default=0.9)
+    parser.add_argument("--json", dest="json_out", help="also write the results to this file")
+    args = parser.parse_args(argv)
+
+    # A run of failures (e.g. missing recordings) must not short-circuit later cases
+    llm.OLLAMA_BREAKER = CircuitBreaker("ollama-eval", min_calls=10 ** 9)
+    catalog = load_catalog()
+    tasks = [t.strip() for t in args.tasks.split(",") if t.strip()]
+    rows = []
+    try:
+        for model in [m.strip() for m in args.models.split(",") if m.strip()]:
+            transport = EvalTransport(model, args.mode)
+            llm.set_transport(transport)
+            for task in tasks:
+                rows.append(evaluate(model, task, load_cases(task), catalog, transport))
+    finally:
+        llm.set_transport(None)
+
+    print_report(rows)
+    best = fastest_passing(rows, args.min_accuracy)
+    print(f"\nFastest model with accuracy >= {args.min_accuracy:.0%} on every task: {best or 'none'}")
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,34 @@
+import time
+_import_started = time.perf_counter()
+
+import asyncio
 import os
 import discord
 from dotenv import load_dotenv
 
-from mantishub.client import MantisHubClient
-from bot.session import (
-    session_exists, create_session, get_session, save_session, clear_session,
-    update_session, add_ticket_to_session, remove_ticket_from_session, log_history, session_expired
-)
+from bot.session import get_session, save_session, reset_session, is_expired
 from bot.user_tickets import (
-    add_ticket_for_user, remove_ticket_for_user, get_tickets_for_user,
+    remove_ticket_for_user, get_tickets_for_user,
     update_ticket_status_for_user, update_ticket_category_for_user
 )
-from bot.kb import llm_troubleshoot
-from bot.llm_ticket import (
-    llm_route,
-    llm_parse_ticket_fields,
-    llm_pick_ticket_id
+from bot.circuit import CircuitBreaker
+from bot.dialog import (
+    ANY, AWAITING_CLARIFICATION, AWAITING_DUPLICATE_CONFIRM, AWAITING_KB_CONFIRM,
+    AWAITING_PROBLEM, AWAITING_TICKET_ACTION_CONFIRM, AWAITING_TICKET_CONFIRM, DialogContext, DialogMachine,
+    reply_event
 )
+from bot.duplicates import forget_ticket, ticket_status_changed
+from bot.ingress import IngressLimiter
+from bot.kb import get_kb, llm_troubleshoot
+from bot.llm import prewarm
+from bot.outbound import Outbox, format_ticket_history
+from bot.pending_ops import enqueue_op, pending_ops, replay_pending
+from bot.router_batch import RouterBatcher
+from bot.ticket_resolver import match_ticket, pick_ticket
+from bot.startup import Startup
+from bot.ticket_cache import PUSHED_PROBE_AFTER, TicketCache
+from bot.ticket_service import QUEUED_MESSAGE, TicketCreationService
+from mantishub.exceptions import MantisHubUnavailable
 
 load_dotenv()
 DISCORD_BOT_TOKEN = os.getenv("DISCORD_BOT_TOKEN")
@@ -26,371 +38,369 @@ intents.messages = True
 intents.dm_messages = True
 
 client = discord.Client(intents=intents)
-mh_client = MantisHubClient()
+outbox = Outbox()
+ticket_cache = TicketCache()
+router = RouterBatcher()
+limiter = IngressLimiter()
+startup = Startup()
+startup.mark("imports", _import_started)
 
-def preserve_tickets_on_reset(user_id):
-    session = get_session(user_id)
-    old_tickets = session.get("tickets", []) if session else []
-    clear_session(user_id)
-    create_session(user_id)
-    update_session(user_id, tickets=old_tickets)
+MANTIS_BREAKER = CircuitBreaker("mantishub", window=20, min_calls=4, failure_rate=0.5, open_seconds=30)
+REPLAY_INTERVAL = 30  # seconds between attempts to run queued ticket operations
+UNAVAILABLE_MESSAGE = "⚠️ I can't help right now because the support system isn't set up correctly. Please try again later."
 
-def push_action(user_id, action):
-    session = get_session(user_id)
-    stack = session.get("action_stack", [])
-    stack.append(action)
-    update_session(user_id, action_stack=stack)
+# Created during startup so that importing main stays cheap
+mh_client = None
+ticket_service = None
+webhooks = None
 
-def pop_action(user_id):
-    session = get_session(user_id)
-    stack = session.get("action_stack", [])
-    if stack:
-        last_action = stack.pop()
-        update_session(user_id, action_stack=stack)
-        return last_action
-    return None
-
-def peek_action(user_id):
-    session = get_session(user_id)
-    stack = session.get("action_stack", [])
-    return stack[-1] if stack else None
+def init_clients():
+    global mh_client, ticket_service
+    from mantishub.client import MantisHubClient
+    mh_client = MantisHubClient(breaker=MANTIS_BREAKER)
+    ticket_service = TicketCreationService(mh_client)
+
+async def notify_user(user_id, text):
+    user = await client.fetch_user(int(user_id))
+    channel = user.dm_channel or await user.create_dm()
+    outbox.send(channel, text)
 
-def clear_action_stack(user_id):
-    update_session(user_id, action_stack=[])
+async def replay_loop():
+    while True:
+        await asyncio.sleep(REPLAY_INTERVAL)
+        if pending_ops() and not MANTIS_BREAKER.is_open:
+            try:
+                await replay_pending(ticket_service, notify_user)
+            except Exception as e:
+                print(f"Replaying queued ticket operations failed: {e}")
 
-def unpack_mantis_ticket(remote):
-    if isinstance(remote, dict) and "issues" in remote and isinstance(remote["issues"], list) and len(remote["issues"]) > 0:
-        return remote["issues"][0]
-    return remote
+async def start_webhooks():
+    global webhooks
+    from bot.webhooks import WEBHOOK_PORT, WebhookReceiver
+    if not WEBHOOK_PORT or webhooks is not None:
+        return
+    receiver = WebhookReceiver(ticket_cache, notify_user)
+    await receiver.start()  # refuses to run without WEBHOOK_SECRET
+    webhooks = receiver
+    # Changes are pushed to us now; probing MantisHub is only a safety net
+    ticket_cache.probe_after = PUSHED_PROBE_AFTER
 
-async def send_help(dm):
-    await dm.send(
+async def warm_up():
+    if ticket_service is None:
+        mark = time.perf_counter()
+        try:
+            init_clients()
+            asyncio.ensure_future(replay_loop())
+        except Exception as e:
+            # e.g. MANTIS_API_BASE unset: still become ready, and answer every message with a notice
+            startup.errors["clients"] = str(e)
+        startup.mark("clients", mark)
+    steps = {
+        "ollama": lambda: asyncio.to_thread(prewarm),
+        "kb": lambda: asyncio.to_thread(get_kb),
+    }
+    if ticket_service is not None:
+        steps.update(catalog=ticket_service.refresh_catalog, webhooks=start_webhooks)
+    await startup.start(steps)
+
+def send_help(channel):
+    outbox.send(
+        channel,
         "**Washing-Machine Bot Help:**\n"
         "- Type your washing machine problem to get help or troubleshooting.\n"
         "- Say things like 'any update on my ticket', 'delete my leak ticket', 'close ticket 15', etc.\n"
         "- Type `status` to see your tickets, or `reset` to restart the session."
     )
 
-@client.event
-async def on_ready():
-    print(f'Logged in as {client.user}!')
+async def escalate(ctx, problem, check_duplicates=True):
+    with limiter.slot(ctx.user_id, "ticket") as refusal:
+        if refusal:
+            # Stay in the current state so the user can simply confirm again later
+            outbox.send(ctx.channel, refusal)
+            return
+        result = await ticket_service.create_ticket(ctx.user_id, ctx.username, problem, check_duplicates=check_duplicates)
+    if result.get("duplicate_of"):
+        ctx.session["problem"] = problem
+        ctx.goto(AWAITING_DUPLICATE_CONFIRM, ticket=result["duplicate_of"])
+    elif result["ok"] or result.get("queued"):
+        ctx.reset()
+    else:
+        ctx.goto(AWAITING_PROBLEM)
+    outbox.send(ctx.channel, result["message"])
 
-@client.event
-async def on_message(message):
-    if message.author == client.user or not isinstance(message.channel, discord.DMChannel):
-        return
+async def render_ticket_status(user_id):
+    user_tickets = get_tickets_for_user(user_id)
+    if not user_tickets:
+        return "You have no open tickets."
+    tids = [t if isinstance(t, int) else t.get("id") for t in user_tickets]
+    snapshots = await asyncio.gather(
+        *(asyncio.to_thread(ticket_cache.fetch, mh_client, tid) for tid in tids),
+        return_exceptions=True
+    )
+    lines = []
+    for t, tid, entry in zip(user_tickets, tids, snapshots):
+        category = "" if isinstance(t, int) else t.get("category", "")
+        status = "" if isinstance(t, int) else t.get("status", "")
+        if isinstance(entry, MantisHubUnavailable):
+            # Show what we last knew rather than an error per ticket
+            cached = ticket_cache.get(tid)
+            summary = cached["issue"].get("summary", "") if cached else (t.get("summary", "") if isinstance(t, dict) else "")
+            lines.append(f"\n――――――――――\nID: `{tid}` | {summary} | Status: {status} (cached) | Category: {category}")
+            continue
+        if isinstance(entry, Exception):
+            lines.append(f"\n――――――――――\nID: `{tid}` | Error fetching ticket: {str(entry)}")
+            continue
+        remote = entry["issue"]
+        summary = remote.get("summary", "No summary")
+        remote_status = remote.get("status", {}).get("name", "Unknown")
+        remote_category = remote.get("category", {}).get("name", "General")
+        if remote_status and remote_status != status:
+            update_ticket_status_for_user(user_id, tid, remote_status)
+            ticket_status_changed(tid, remote_status)
+            status = remote_status
+        if remote_category and remote_category != category:
+            update_ticket_category_for_user(user_id, tid, remote_category)
+            category = remote_category
+        new_notes = ticket_cache.take_new_notes(entry)
+        lines.append(format_ticket_history(tid, summary, status, category, new_notes, total_notes=len(entry["notes"])))
+    header = "Ticket updates/history:"
+    if MANTIS_BREAKER.is_open:
+        header = "⚠️ Our ticket system is unavailable, showing the last known status.\n" + header
+    return header + "\n".join(lines)
 
-    user_id = str(message.author.id)
-    discord_username = message.author.name
-    msg = message.content.strip()
-    session = get_session(user_id)
+async def resolve_ticket(ctx, skip_status=None):
+    """
+    (ticket ID, None) for the ticket ctx.msg refers to, or (None, refusal) when
+    only the LLM could tell and the user is over the pick_ticket limit.
+    """
+    tid, candidates = await asyncio.to_thread(match_ticket, ctx.msg, get_tickets_for_user(ctx.user_id), skip_status)
+    if not candidates:
+        return tid, None
+    with limiter.slot(ctx.user_id, "pick_ticket") as refusal:
+        if refusal:
+            return None, refusal
+        return await asyncio.to_thread(pick_ticket, ctx.msg, candidates), None
 
-    # Session expiry (5 minutes inactivity), preserve tickets
-    if session_expired(user_id):
-        preserve_tickets_on_reset(user_id)
-        clear_action_stack(user_id)
-        await message.channel.send("🔒 Your previous session expired due to inactivity. Let's start fresh. What's your washing machine issue?")
-        return
+# ---------------- DIALOG TRANSITIONS ----------------
+dialog = DialogMachine()
 
-    if not session_exists(user_id) or msg.lower() == "reset":
-        preserve_tickets_on_reset(user_id)
-        clear_action_stack(user_id)
-        await message.channel.send("👋 Hi! I’m Washing-Machine Bot. What’s the issue with your machine?")
-        return
+@dialog.on(ANY, "help")
+async def on_help(ctx):
+    ctx.goto(AWAITING_PROBLEM)
+    send_help(ctx.channel)
 
-    session = get_session(user_id)
+@dialog.on(ANY, "greeting")
+async def on_greeting(ctx):
+    ctx.goto(AWAITING_PROBLEM)
+    outbox.send(ctx.channel, "😊 Hi there! Let me know if you have any washing machine issues or questions!")
 
-    # --- UNIVERSAL COMMANDS ---
-    if msg.lower().startswith("help") or msg.lower().startswith("!help"):
-        clear_action_stack(user_id)
-        await send_help(message.channel)
-        return
+@dialog.on(ANY, "out_of_scope")
+async def on_out_of_scope(ctx):
+    ctx.goto(AWAITING_PROBLEM)
+    outbox.send(ctx.channel, "Sorry, I can only help with washing machine problems.")
 
-    # -------- YES/NO LOGIC, MAPPED TO ACTION STACK -----------
-    if msg.lower() in ["yes", "y", "no", "n"]:
-        last_action = peek_action(user_id)
-        if last_action == "asked_kb":
-            if msg.lower() in ["yes", "y"]:
-                await message.channel.send("✅ Glad I could help! If you have another issue, just describe it.")
-                clear_action_stack(user_id)
-                preserve_tickets_on_reset(user_id)
-                return
-            else:  # "no"
-                clear_action_stack(user_id)
-                projects = mh_client.list_projects()
-                if not projects:
-                    await message.channel.send("⚠️ No projects found in MantisHub. Contact admin.")
-                    return
-                categories_by_project = {str(p['id']): mh_client.list_categories(p['id']) for p in projects}
-                parsed = llm_parse_ticket_fields(session.get("problem", msg), projects, categories_by_project)
-                if not parsed:
-                    fallback_project = projects[0]
-                    fallback_categories = categories_by_project.get(str(fallback_project['id']), [])
-                    if fallback_categories:
-                        fallback_category = fallback_categories[0]
-                        ticket = mh_client.create_ticket(
-                            summary=f"{discord_username}: {session.get('problem', msg)[:50]}",
-                            description=session.get('problem', msg),
-                            project_id=fallback_project['id'],
-                            category=fallback_category['name']
-                        )
-                        ticket_id = ticket.get("issue", {}).get("id") or ticket.get("id")
-                        add_ticket_for_user(
-                            user_id, ticket_id,
-                            category=fallback_category['name'], status="open"
-                        )
-                        await message.channel.send(f"🎫 Ticket created (default category)! Your ticket ID is `{ticket_id}`. You can check status by typing `status`.")
-                        preserve_tickets_on_reset(user_id)
-                        return
-                    else:
-                        await message.channel.send("Sorry, I couldn't create a ticket because there is no available category. Please contact support.")
-                        return
-                else:
-                    project_id = next((p['id'] for p in projects if p['name'].lower() == parsed['project_name'].lower()), None)
-                    category_id = None
-                    if project_id:
-                        categories = categories_by_project[str(project_id)]
-                        category_id = next((c['id'] for c in categories if c['name'].lower() == parsed['category_name'].lower()), None)
-                    if not (project_id and category_id):
-                        await message.channel.send("Sorry, I couldn't match your issue to an exact project/category. Please try rephrasing or contact support.")
-                        return
-                    ticket = mh_client.create_ticket(
-                        summary=f"{discord_username}: {parsed['summary']}",
-                        description=parsed['description'],
-                        project_id=project_id,
-                        category=parsed['category_name']
-                    )
-                    ticket_id = ticket.get("issue", {}).get("id") or ticket.get("id")
-                    add_ticket_for_user(
-                        user_id, ticket_id,
-                        category=parsed['category_name'], status="open"
-                    )
-                    await message.channel.send(f"🎫 Ticket created! Your ticket ID is `{ticket_id}`. You can check status by typing `status`.")
-                    preserve_tickets_on_reset(user_id)
-                    return
-
-        elif last_action == "asked_ticket":
-            if msg.lower() in ["yes", "y"]:
-                await message.channel.send("🎫 Ticket created! You can check status by typing `status`.")
-            else:
-                await message.channel.send("👍 No ticket created. If you have another issue, just describe it.")
-            clear_action_stack(user_id)
-            preserve_tickets_on_reset(user_id)
-            return
+@dialog.on(ANY, "security")
+async def on_security(ctx):
+    ctx.reset()
+    outbox.send(ctx.channel, "🚫 Sorry, I can't share sensitive information.")
 
-    # -------- LLM INTENT ROUTING FOR ALL CASES ----------
-    route = llm_route(msg, session)
-    action = route.get("action")
-    info = route.get("info", "")
+@dialog.on(ANY, "ticket_status")
+async def on_ticket_status(ctx):
+    ctx.goto(AWAITING_PROBLEM)
+    outbox.send(ctx.channel, await render_ticket_status(ctx.user_id))
 
-    if action == "help":
-        clear_action_stack(user_id)
-        await send_help(message.channel)
-        return
-    if action == "greeting":
-        clear_action_stack(user_id)
-        await message.channel.send("😊 Hi there! Let me know if you have any washing machine issues or questions!")
-        return
-    if action == "out_of_scope":
-        clear_action_stack(user_id)
-        await message.channel.send("Sorry, I can only help with washing machine problems.")
+async def delete_ticket(ctx, tid):
+    try:
+        await asyncio.to_thread(mh_client.delete_ticket, tid)
+        remove_ticket_for_user(ctx.user_id, tid)
+        forget_ticket(tid)
+        ticket_cache.forget(tid)
+        outbox.send(ctx.channel, f"🗑️ Ticket `{tid}` deleted.")
+    except MantisHubUnavailable:
+        enqueue_op("delete", ctx.user_id, ticket_id=tid)
+        outbox.send(ctx.channel, QUEUED_MESSAGE)
+    except Exception as e:
+        outbox.send(ctx.channel, f"Error deleting ticket: {e}")
+
+async def close_ticket(ctx, tid):
+    try:
+        await asyncio.to_thread(mh_client.update_ticket, tid, {"status": {"id": 90}})
+        update_ticket_status_for_user(ctx.user_id, tid, "closed")
+        forget_ticket(tid)
+        outbox.send(ctx.channel, f"✅ Ticket `{tid}` closed.")
+    except MantisHubUnavailable:
+        enqueue_op("close", ctx.user_id, ticket_id=tid)
+        outbox.send(ctx.channel, QUEUED_MESSAGE)
+    except Exception as e:
+        outbox.send(ctx.channel, f"Error closing ticket: {e}")
+
+TICKET_ACTIONS = {"delete": delete_ticket, "close": close_ticket}
+
+@dialog.on(ANY, "delete_ticket")
+async def on_delete_ticket(ctx):
+    tid, refusal = await resolve_ticket(ctx)
+    if tid is None:
+        outbox.send(ctx.channel, refusal or "Which ticket would you like to delete? Please specify the ticket ID or summary.")
         return
-    if action == "security":
-        clear_action_stack(user_id)
-        await message.channel.send("🚫 Sorry, I can't share sensitive information.")
-        preserve_tickets_on_reset(user_id)
+    ctx.goto(AWAITING_PROBLEM)
+    await delete_ticket(ctx, tid)
+
+@dialog.on(ANY, "close_ticket")
+async def on_close_ticket(ctx):
+    tid, refusal = await resolve_ticket(ctx, skip_status=("closed", "resolved"))
+    if tid is None:
+        outbox.send(ctx.channel, refusal or "Which ticket would you like to close? Please specify the ticket ID or summary.")
         return
+    ctx.goto(AWAITING_PROBLEM)
+    await close_ticket(ctx, tid)
 
-    if action == "ticket_status":
-        user_tickets = get_tickets_for_user(user_id)
-        if not user_tickets:
-            await message.channel.send("You have no open tickets.")
-        else:
-            lines = []
-            for t in user_tickets:
-                if isinstance(t, int):
-                    tid = t
-                    category = ""
-                    status = ""
-                else:
-                    tid = t.get("id")
-                    category = t.get("category", "")
-                    status = t.get("status", "")
-                try:
-                    remote = mh_client.get_ticket(tid)
-                    remote = unpack_mantis_ticket(remote)
-                    summary = remote.get("summary", "No summary")
-                    remote_status = remote.get("status", {}).get("name", "Unknown")
-                    remote_category = remote.get("category", {}).get("name", "General")
-                    notes = remote.get("notes", [])
-                    if remote_status and remote_status != status:
-                        update_ticket_status_for_user(user_id, tid, remote_status)
-                        status = remote_status
-                    if remote_category and remote_category != category:
-                        update_ticket_category_for_user(user_id, tid, remote_category)
-                        category = remote_category
-                    update_text = ""
-                    if notes:
-                        update_text = "\n".join([f"- {n.get('text', '')}" for n in notes])
-                    lines.append(f"\n――――――――――\nID: `{tid}` | {summary} | Status: {status} | Category: {category}\nUpdates:\n{update_text}")
-                except Exception as e:
-                    lines.append(f"\n――――――――――\nID: `{tid}` | Error fetching ticket: {str(e)}")
-            await message.channel.send("Ticket updates/history:" + "\n".join(lines))
-        clear_action_stack(user_id)
+async def confirm_ticket_action(ctx, action, skip_status=None):
+    # Routed on keywords (LLM unavailable): ask before touching any ticket
+    tickets = get_tickets_for_user(ctx.user_id)
+    tid, _ = await asyncio.to_thread(match_ticket, ctx.msg, tickets, skip_status)
+    if tid is None:
+        ctx.goto(AWAITING_PROBLEM)
+        outbox.send(ctx.channel, f"Which ticket would you like to {action}? Please include its ID, e.g. `{action} ticket 15`.")
         return
+    summary = next((t.get("summary", "") for t in tickets if isinstance(t, dict) and int(t["id"]) == tid), "")
+    ctx.goto(AWAITING_TICKET_ACTION_CONFIRM, ticket=tid, action=action)
+    outbox.send(ctx.channel, f"Do you want to {action} ticket `{tid}`" + (f" ({summary})" if summary else "") + "? (yes/no)")
 
-    if action == "delete_ticket":
-        user_tickets = get_tickets_for_user(user_id)
-        tid = llm_pick_ticket_id(msg, user_tickets)
-        if tid is None:
-            await message.channel.send("Which ticket would you like to delete? Please specify the ticket ID or summary.")
-            return
-        try:
-            mh_client.delete_ticket(tid)
-            remove_ticket_for_user(user_id, tid)
-            await message.channel.send(f"🗑️ Ticket `{tid}` deleted.")
-        except Exception as e:
-            await message.channel.send(f"Error deleting ticket: {e}")
-        clear_action_stack(user_id)
+@dialog.on(ANY, "confirm_delete_ticket")
+async def on_confirm_delete_ticket(ctx):
+    await confirm_ticket_action(ctx, "delete")
+
+@dialog.on(ANY, "confirm_close_ticket")
+async def on_confirm_close_ticket(ctx):
+    await confirm_ticket_action(ctx, "close", skip_status=("closed", "resolved"))
+
+@dialog.on(AWAITING_TICKET_ACTION_CONFIRM, "yes")
+async def on_ticket_action_confirmed(ctx):
+    action, tid = ctx.data.get("action"), ctx.data.get("ticket")
+    ctx.goto(AWAITING_PROBLEM)
+    await TICKET_ACTIONS[action](ctx, tid)
+
+@dialog.on(AWAITING_TICKET_ACTION_CONFIRM, "no")
+async def on_ticket_action_declined(ctx):
+    ctx.reset()
+    outbox.send(ctx.channel, "👍 Okay, your ticket was left as it is. If you have another issue, just describe it.")
+
+@dialog.on(ANY, "clarify")
+async def on_clarify(ctx):
+    if ctx.session.get("clarification_asked", False):
+        await escalate(ctx, ctx.session.get("problem", ctx.msg))
         return
+    outbox.send(ctx.channel, "Can you please clarify your washing machine issue with more detail?")
+    ctx.session.update(problem=ctx.msg, clarification_asked=True)
+    ctx.goto(AWAITING_CLARIFICATION)
 
-    if action == "close_ticket":
-        user_tickets = get_tickets_for_user(user_id)
-        tid = llm_pick_ticket_id(msg, user_tickets)
-        if tid is None:
-            await message.channel.send("Which ticket would you like to close? Please specify the ticket ID or summary.")
+@dialog.on(ANY, "kb_answer")
+async def on_kb_answer(ctx):
+    with limiter.slot(ctx.user_id, "troubleshoot") as refusal:
+        if refusal:
+            outbox.send(ctx.channel, refusal)
             return
-        try:
-            mh_client.update_ticket(tid, {"status": {"id": 90}})
-            update_ticket_status_for_user(user_id, tid, "closed")
-            await message.channel.send(f"✅ Ticket `{tid}` closed.")
-        except Exception as e:
-            await message.channel.send(f"Error closing ticket: {e}")
-        clear_action_stack(user_id)
+        answer = await asyncio.to_thread(
+            llm_troubleshoot, ctx.msg, clarification_mode=ctx.session.get("clarification_asked", False)
+        )
+    ctx.session.update(problem=ctx.msg, last_msg=ctx.msg, clarification_asked=False)
+    if not answer:
+        outbox.send(ctx.channel, "I couldn't find a fix for that. Would you like me to create a support ticket? (yes/no)")
+        ctx.goto(AWAITING_TICKET_CONFIRM)
         return
+    outbox.send(ctx.channel, f"🧰 Possible Solution:\n\n{answer}\n\nDid this help? (yes/no)")
+    ctx.session["kb_solution"] = answer
+    ctx.goto(AWAITING_KB_CONFIRM)
 
-    if action == "clarify":
-        if session.get("clarification_asked", False):
-            projects = mh_client.list_projects()
-            if not projects:
-                await message.channel.send("⚠️ No projects found in MantisHub. Contact admin.")
-                return
-            categories_by_project = {str(p['id']): mh_client.list_categories(p['id']) for p in projects}
-            parsed = llm_parse_ticket_fields(session.get("problem", msg), projects, categories_by_project)
-            if not parsed:
-                fallback_project = projects[0]
-                fallback_categories = categories_by_project.get(str(fallback_project['id']), [])
-                if fallback_categories:
-                    fallback_category = fallback_categories[0]
-                    ticket = mh_client.create_ticket(
-                        summary=f"{discord_username}: {session.get('problem', msg)[:50]}",
-                        description=session.get('problem', msg),
-                        project_id=fallback_project['id'],
-                        category=fallback_category['name']
-                    )
-                    ticket_id = ticket.get("issue", {}).get("id") or ticket.get("id")
-                    add_ticket_for_user(
-                        user_id, ticket_id,
-                        category=fallback_category['name'], status="open"
-                    )
-                    await message.channel.send(f"🎫 Ticket created (default category)! Your ticket ID is `{ticket_id}`. You can check status by typing `status`.")
-                    preserve_tickets_on_reset(user_id)
-                    return
-                else:
-                    await message.channel.send("Sorry, I couldn't create a ticket because there is no available category. Please contact support.")
-                    return
-            else:
-                project_id = next((p['id'] for p in projects if p['name'].lower() == parsed['project_name'].lower()), None)
-                category_id = None
-                if project_id:
-                    categories = categories_by_project[str(project_id)]
-                    category_id = next((c['id'] for c in categories if c['name'].lower() == parsed['category_name'].lower()), None)
-                if not (project_id and category_id):
-                    await message.channel.send("Sorry, I couldn't match your issue to an exact project/category. Please try rephrasing or contact support.")
-                    return
-                ticket = mh_client.create_ticket(
-                    summary=f"{discord_username}: {parsed['summary']}",
-                    description=parsed['description'],
-                    project_id=project_id,
-                    category=parsed['category_name']
-                )
-                ticket_id = ticket.get("issue", {}).get("id") or ticket.get("id")
-                add_ticket_for_user(
-                    user_id, ticket_id,
-                    category=parsed['category_name'], status="open"
-                )
-                await message.channel.send(f"🎫 Ticket created! Your ticket ID is `{ticket_id}`. You can check status by typing `status`.")
-                preserve_tickets_on_reset(user_id)
-                return
-        else:
-            await message.channel.send("Can you please clarify your washing machine issue with more detail?")
-            update_session(user_id, clarification_asked=True)
-            push_action(user_id, "asked_kb")
+@dialog.on(ANY, "create_ticket")
+async def on_create_ticket(ctx):
+    await escalate(ctx, ctx.session.get("problem", ctx.msg))
+
+@dialog.on(AWAITING_KB_CONFIRM, "yes")
+async def on_kb_helped(ctx):
+    ctx.reset()
+    outbox.send(ctx.channel, "✅ Glad I could help! If you have another issue, just describe it.")
+
+@dialog.on([AWAITING_KB_CONFIRM, AWAITING_CLARIFICATION], "no")
+@dialog.on(AWAITING_TICKET_CONFIRM, "yes")
+async def on_escalation_reply(ctx):
+    # "no" after a KB answer or clarification request, or "yes" to a ticket offer
+    await escalate(ctx, ctx.session.get("problem", ctx.msg))
+
+@dialog.on(AWAITING_TICKET_CONFIRM, "no")
+async def on_ticket_declined(ctx):
+    ctx.reset()
+    outbox.send(ctx.channel, "👍 No ticket created. If you have another issue, just describe it.")
+
+@dialog.on(AWAITING_DUPLICATE_CONFIRM, "yes")
+async def on_attach_to_duplicate(ctx):
+    result = await ticket_service.attach_to_ticket(ctx.user_id, ctx.data.get("ticket"), ctx.session.get("problem", ctx.msg))
+    ctx.reset()
+    outbox.send(ctx.channel, result["message"])
+
+@dialog.on(AWAITING_DUPLICATE_CONFIRM, "no")
+async def on_create_despite_duplicate(ctx):
+    await escalate(ctx, ctx.session.get("problem", ctx.msg), check_duplicates=False)
+
+@dialog.on_enter(AWAITING_KB_CONFIRM)
+async def prefetch_catalog(ctx):
+    # A "no" is the likely next reply; have the catalog ready for the ticket
+    await ticket_service.prefetch_catalog()
+
+@client.event
+async def on_ready():
+    print(f'Logged in as {client.user}!')
+    await warm_up()
+
+@client.event
+async def on_message(message):
+    if message.author == client.user or not isinstance(message.channel, discord.DMChannel):
+        return
+    await startup.wait()
+    try:
+        if ticket_service is None:
+            outbox.send(message.channel, UNAVAILABLE_MESSAGE)
             return
+        await handle_message(message)
+    finally:
+        # Deliver everything the handler queued as few, size-limited messages
+        await outbox.flush(message.channel)
+
+async def handle_message(message):
+    user_id = str(message.author.id)
+    msg = message.content.strip()
+    session = get_session(user_id)
 
-    if action == "kb_answer":
-        answer = llm_troubleshoot(msg, clarification_mode=session.get("clarification_asked", False))
-        update_session(user_id, problem=msg, last_msg=msg)
-        await message.channel.send(f"🧰 Possible Solution:\n\n{answer}\n\nDid this help? (yes/no)")
-        update_session(user_id, state="awaiting_kb_confirm", kb_solution=answer, clarification_asked=False)
-        push_action(user_id, "asked_kb")
+    # New user, expired session (inactivity) or explicit reset: start over, keeping tickets
+    if session is None or is_expired(session) or msg.lower() == "reset":
+        if session is not None and is_expired(session):
+            greeting = "🔒 Your previous session expired due to inactivity. Let's start fresh. What's your washing machine issue?"
+        else:
+            greeting = "👋 Hi! I’m Washing-Machine Bot. What’s the issue with your machine?"
+        reset_session(user_id, tickets=session.get("tickets", []) if session else [])
+        outbox.send(message.channel, greeting)
         return
 
-    if action == "create_ticket":
-        projects = mh_client.list_projects()
-        if not projects:
-            await message.channel.send("⚠️ No projects found in MantisHub. Contact admin.")
+    ctx = DialogContext(user_id, message.author.name, msg, message.channel, session)
+    try:
+        if msg.lower().startswith("help") or msg.lower().startswith("!help"):
+            await dialog.dispatch(ctx, "help")
             return
-        categories_by_project = {str(p['id']): mh_client.list_categories(p['id']) for p in projects}
-        parsed = llm_parse_ticket_fields(session.get("problem", msg), projects, categories_by_project)
-        if not parsed:
-            fallback_project = projects[0]
-            fallback_categories = categories_by_project.get(str(fallback_project['id']), [])
-            if fallback_categories:
-                fallback_category = fallback_categories[0]
-                ticket = mh_client.create_ticket(
-                    summary=f"{discord_username}: {session.get('problem', msg)[:50]}",
-                    description=session.get('problem', msg),
-                    project_id=fallback_project['id'],
-                    category=fallback_category['name']
-                )
-                ticket_id = ticket.get("issue", {}).get("id") or ticket.get("id")
-                add_ticket_for_user(
-                    user_id, ticket_id,
-                    category=fallback_category['name'], status="open"
-                )
-                await message.channel.send(f"🎫 Ticket created (default category)! Your ticket ID is `{ticket_id}`. You can check status by typing `status`.")
-                preserve_tickets_on_reset(user_id)
-                return
-            else:
-                await message.channel.send("Sorry, I couldn't create a ticket because there is no available category. Please contact support.")
-                return
-        else:
-            project_id = next((p['id'] for p in projects if p['name'].lower() == parsed['project_name'].lower()), None)
-            category_id = None
-            if project_id:
-                categories = categories_by_project[str(project_id)]
-                category_id = next((c['id'] for c in categories if c['name'].lower() == parsed['category_name'].lower()), None)
-            if not (project_id and category_id):
-                await message.channel.send("Sorry, I couldn't match your issue to an exact project/category. Please try rephrasing or contact support.")
-                return
-            ticket = mh_client.create_ticket(
-                summary=f"{discord_username}: {parsed['summary']}",
-                description=parsed['description'],
-                project_id=project_id,
-                category=parsed['category_name']
-            )
-            ticket_id = ticket.get("issue", {}).get("id") or ticket.get("id")
-            add_ticket_for_user(
-                user_id, ticket_id,
-                category=parsed['category_name'], status="open"
-            )
-            await message.channel.send(f"🎫 Ticket created! Your ticket ID is `{ticket_id}`. You can check status by typing `status`.")
-            preserve_tickets_on_reset(user_id)
+
+        # Bare yes/no only means something in states that asked a question
+        event = reply_event(msg)
+        if event and await dialog.dispatch(ctx, event):
             return
 
-    # Fallback
-    await message.channel.send("Sorry, I didn't understand. Please describe your washing machine problem, or type `help` for options.")
+        with limiter.slot(user_id, "router") as refusal:
+            if refusal:
+                outbox.send(message.channel, refusal)
+                return
+            route = await router.route(msg, ctx.session)
+        if not await dialog.dispatch(ctx, route.get("action")):
+            outbox.send(message.channel, "Sorry, I didn't understand. Please describe your washing machine problem, or type `help` for options.")
+    finally:
+        save_session(user_id, ctx.session)
 
 if __name__ == "__main__":
     client.run(DISCORD_BOT_TOKEN)
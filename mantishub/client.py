@@ -1,31 +1,68 @@
 # mantishub/client.py
 
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import requests
+from requests.adapters import HTTPAdapter
 from config.settings import MANTIS_API_BASE, MANTIS_API_TOKEN
 from mantishub.exceptions import (
     MantisHubAPIError,
     MantisHubNotFound,
     MantisHubUnauthorized,
+    MantisHubUnavailable,
 )
 
+CLOSED_STATUS_ID = 90
+
 class MantisHubClient:
-    def __init__(self):
+    def __init__(self, breaker=None, timeout=10, max_workers=8):
+        """
+        breaker: optional circuit breaker (allow/record_success/record_failure/retry_in).
+        While it is open, requests fail fast with MantisHubUnavailable.
+        max_workers: concurrency bound for the bulk operations.
+        """
         self.base = MANTIS_API_BASE.rstrip("/")
         self.headers = {
             "Authorization": MANTIS_API_TOKEN,
             "Content-Type": "application/json",
         }
+        self.breaker = breaker
+        self.timeout = timeout
+        self.max_workers = max_workers
+        # Pooled keep-alive connections, sized for the bulk operations' workers
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
 
-    def _request(self, method, path, **kwargs):
+    def _send(self, method, path, headers=None, **kwargs):
+        """Perform the HTTP call through the circuit breaker and return the raw response."""
         url = f"{self.base}{path}"
+        if self.breaker and not self.breaker.allow():
+            raise MantisHubUnavailable(f"MantisHub unavailable, retry in {self.breaker.retry_in():.0f}s")
+        try:
+            resp = self.session.request(method, url, headers={**self.headers, **(headers or {})}, timeout=self.timeout, **kwargs)
+        except requests.exceptions.RequestException as e:
+            if self.breaker:
+                self.breaker.record_failure()
+            raise MantisHubUnavailable(f"Request failed: {str(e)}")
+        if self.breaker:
+            # Only server-side errors count against MantisHub's health
+            if resp.status_code >= 500:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+        if resp.status_code == 401:
+            raise MantisHubUnauthorized("Invalid or missing API token")
+        if resp.status_code == 404:
+            raise MantisHubNotFound(f"Resource not found: {url}")
+        if not resp.ok:
+            raise MantisHubAPIError(f"API Error {resp.status_code}: {resp.text}")
+        return resp
+
+    def _request(self, method, path, **kwargs):
+        resp = self._send(method, path, **kwargs)
         try:
-            resp = requests.request(method, url, headers=self.headers, timeout=10, **kwargs)
-            if resp.status_code == 401:
-                raise MantisHubUnauthorized("Invalid or missing API token")
-            if resp.status_code == 404:
-                raise MantisHubNotFound(f"Resource not found: {url}")
-            if not resp.ok:
-                raise MantisHubAPIError(f"API Error {resp.status_code}: {resp.text}")
             if resp.content:
                 return resp.json()
             return {}
@@ -71,6 +108,42 @@ class MantisHubClient:
         response = self._request("GET", path)
         return response.get("issue", response)
 
+    def get_ticket_if_changed(self, ticket_id, etag=None, last_modified=None):
+        """
+        Conditional fetch of a ticket. Returns (issue, validators), where issue
+        is None if the server answered 304 Not Modified. validators holds the
+        ETag/Last-Modified headers to pass next time (empty if unsupported).
+        """
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        resp = self._send("GET", f"/issues/{ticket_id}", headers=headers)
+        validators = {
+            "etag": resp.headers.get("ETag"),
+            "last_modified": resp.headers.get("Last-Modified"),
+        }
+        if resp.status_code == 304:
+            return None, validators
+        try:
+            data = resp.json() if resp.content else {}
+        except requests.exceptions.RequestException as e:
+            raise MantisHubAPIError(f"Request failed: {str(e)}")
+        if isinstance(data.get("issues"), list) and data["issues"]:
+            return data["issues"][0], validators
+        return data.get("issue", data), validators
+
+    def get_ticket_updated_at(self, ticket_id):
+        """
+        Cheap probe for a ticket's last update time, selecting only id and
+        updated_at so notes are not transferred.
+        """
+        data = self._request("GET", f"/issues/{ticket_id}", params={"select": "id,updated_at"})
+        issues = data.get("issues")
+        issue = issues[0] if isinstance(issues, list) and issues else data.get("issue", data)
+        return issue.get("updated_at")
+
     def update_ticket(self, ticket_id, updates):
         """
         Update a ticket (patch). 
@@ -119,6 +192,67 @@ class MantisHubClient:
         payload = {"handler": {"id": user_id}}
         return self._request("PATCH", path, json=payload)
 
+    # --- Bulk operations ---
+
+    def _bulk(self, fn, ticket_ids, max_workers=None):
+        """
+        Run fn(ticket_id) for every id with at most max_workers in flight.
+        Returns {ticket_id: {"ok": True, "result": ...} or {"ok": False, "error": "..."}},
+        in the order the ids were given. One failing id never aborts the rest.
+        """
+        ticket_ids = list(dict.fromkeys(int(t) for t in ticket_ids))
+        report = {}
+        with ThreadPoolExecutor(max_workers=max_workers or self.max_workers) as pool:
+            futures = {pool.submit(fn, tid): tid for tid in ticket_ids}
+            for future in as_completed(futures):
+                tid = futures[future]
+                try:
+                    report[tid] = {"ok": True, "result": future.result()}
+                except Exception as e:  # timeouts, connection errors, bad JSON: still one entry per id
+                    report[tid] = {"ok": False, "error": str(e) or type(e).__name__}
+        return {tid: report[tid] for tid in ticket_ids}
+
+    def get_tickets(self, ticket_ids, max_workers=None):
+        """Fetch many tickets; per-id report as in _bulk."""
+        return self._bulk(self.get_ticket, ticket_ids, max_workers)
+
+    def update_tickets(self, ticket_ids, updates, max_workers=None):
+        """Apply the same patch to many tickets; per-id report as in _bulk."""
+        return self._bulk(lambda tid: self.update_ticket(tid, updates), ticket_ids, max_workers)
+
+    def close_tickets(self, ticket_ids, max_workers=None):
+        """Close many tickets; per-id report as in _bulk."""
+        return self.update_tickets(ticket_ids, {"status": {"id": CLOSED_STATUS_ID}}, max_workers)
+
+    def assign_tickets(self, ticket_ids, user_id, max_workers=None):
+        """Assign many tickets to one handler; per-id report as in _bulk."""
+        return self._bulk(lambda tid: self.assign_ticket(tid, user_id), ticket_ids, max_workers)
+
+    def iter_issues(self, filter_id=None, project_id=None, page_size=50, select=None):
+        """
+        Yield issues page by page (GET /issues), optionally restricted to a
+        saved filter or a project. Only one page is held in memory at a time.
+        Parameters:
+        - filter_id: saved filter id or a standard one ("assigned", "reported", "monitored", "unassigned")
+        - project_id: integer
+        - select: comma-separated fields to return, e.g. "id,status,handler"
+        """
+        params = {"page_size": page_size}
+        if filter_id is not None:
+            params["filter_id"] = filter_id
+        if project_id is not None:
+            params["project_id"] = project_id
+        if select:
+            params["select"] = select
+        page = 1
+        while True:
+            data = self._request("GET", "/issues", params={**params, "page": page})
+            issues = data.get("issues", [])
+            yield from issues
+            if len(issues) < page_size:
+                return
+            page += 1
+
 # Optional: Quick smoke test
 if __name__ == "__main__":
     client = MantisHubClient()
@@ -6,3 +6,6 @@ class MantisHubNotFound(MantisHubAPIError):
 
 class MantisHubUnauthorized(MantisHubAPIError):
     pass
+
+class MantisHubUnavailable(MantisHubAPIError):
+    pass